@@ -1,17 +1,13 @@
-from dataset.util import download_prices
-from collections import defaultdict
+from dataset.util import download_prices, sql_find_model
 import plotly.express as px
-from scipy import spatial
 import pandas as pd
 import numpy as np
 import pickle
-import tqdm
 import glob
 import os
 
 
 COMP_MAP_FN = glob.glob(os.path.join('data', 'company-embs-*-map.pkl'))[0]
-COMP_EMBS_FNS = glob.glob(os.path.join('data', 'company-embs-*-article-embs-*-*-*-keras-*-*.npy'))
 
 
 def _load_price_data(symbols, price_col):
@@ -30,15 +26,31 @@ def _load_price_data(symbols, price_col):
     return dates, df_all
 
 
-def plot_price_corr_vs_emb_dist(embs_substring, price_col='lg_close'):
-
-    comp_embs_fn = None
-    for fn in COMP_EMBS_FNS:
-        if embs_substring in fn:
-            comb_embs_fn = fn
-            break
+def pair_corr_vs_emb_sim(df, embs, sym_to_idx):
+    # every pair's price correlation and embedding dot product, from one
+    # corr() and one Gram matrix, upper triangle only
+    symbols = list(df.columns)
+    corr = df.corr().to_numpy()
+    vecs = embs[[sym_to_idx[sym] for sym in symbols]]
+    sims = vecs @ vecs.T
+    rows, cols = np.triu_indices(len(symbols), k=1)
+    corr_ab, sim_ab = corr[rows, cols], sims[rows, cols]
+    keep = ~np.isnan(corr_ab) & ~np.isnan(sim_ab)
+    names = np.char.add(np.char.add(np.array(symbols)[rows[keep]], ' '), np.array(symbols)[cols[keep]])
+    return pd.DataFrame({
+        'Price Correlation': corr_ab[keep],
+        'Emb. Similarity': sim_ab[keep],
+        'name': names
+    })
+
+
+def plot_price_corr_vs_emb_dist(embs_substrings, price_col='lg_close'):
+
+    # one price panel, any number of company embedding models against it
+    if isinstance(embs_substrings, str):
+        embs_substrings = [embs_substrings]
+    comp_embs_fns = {sub: sql_find_model(sub)['embs_path'] for sub in embs_substrings}
 
-    embs = np.load(comb_embs_fn)
     with open(COMP_MAP_FN, 'rb') as f:
         sym_to_idx = pickle.load(f)
 
@@ -58,28 +70,21 @@ def plot_price_corr_vs_emb_dist(embs_substring, price_col='lg_close'):
     print('Loaded', len(sym_to_idx), 'companies, using', len(symbols))
     print('From', dates[0], 'to', dates[-1])
 
-    plot_data = defaultdict(list)
-    for i in range(len(symbols)):
-        for j in range(i + 1, len(symbols)):
-            sym_a = symbols[i]
-            sym_b = symbols[j]
-            corr_a_b = float(df[[sym_a]].corrwith(df[sym_b]).to_numpy().squeeze())
-            emb_sim = float(np.dot(embs[sym_to_idx[sym_a]], embs[sym_to_idx[sym_b]]))
-            if corr_a_b != corr_a_b or emb_sim != emb_sim:
-                # nan-ness check
-                continue
-            plot_data['Price Correlation'].append(float(corr_a_b))
-            plot_data['Emb. Similarity'].append(float(emb_sim))
-            plot_data['name'].append(sym_a + ' ' + sym_b)
-
-    plot_df = pd.DataFrame(plot_data)
+    plot_dfs = []
+    for sub, comp_embs_fn in comp_embs_fns.items():
+        plot_df = pair_corr_vs_emb_sim(df, np.load(comp_embs_fn), sym_to_idx)
+        print(sub)
+        print(plot_df.corr(numeric_only=True))
+        plot_df['model'] = sub
+        plot_dfs.append(plot_df)
+    plot_df = pd.concat(plot_dfs, ignore_index=True)
+
     fig = px.scatter(plot_df, x='Emb. Similarity', y='Price Correlation', 
-        hover_name='name', trendline='ols', 
+        hover_name='name', trendline='ols', facet_col='model',
         title='Company Pairs: Price Correlation vs. Embedding Similarity')
+    fig.update_xaxes(matches=None)
     fig.show()
 
-    print(plot_df.corr())
-
 
 if __name__ == '__main__':
-    plot_price_corr_vs_emb_dist('counts-content-keras-1024-3', 'lg_topen_to_tclose')
\ No newline at end of file
+    plot_price_corr_vs_emb_dist(['counts-content-keras-1024-3'], 'lg_topen_to_tclose')
@@ -1,18 +1,27 @@
-from dataset.util import mkdir, download_prices, reduce_embs
+from dataset.util import (
+    mkdir, download_prices, reduce_embs, sql_find_model, share_arrays, attach_arrays, worker_pool, WORKER
+)
+from dataset.config import MAX_PROCS
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from scipy.ndimage.filters import gaussian_filter
+from matplotlib.figure import Figure
+from collections import deque
 import matplotlib.colors as colors
-import matplotlib.pyplot as plt
+import matplotlib.cm as cm
 import pandas as pd
 import numpy as np
 import pickle
+import subprocess
+import itertools
 import tqdm
+import time
 import glob
 import os
 
 
 COMP_MAP_FN = glob.glob(os.path.join('data', 'company-embs-*-map.pkl'))[0]
-COMP_EMBS_FNS = glob.glob(os.path.join('data', 'company-embs-*-article-embs-*-*-*-keras-*-*.npy'))
 SAVE_DIR = os.path.join('data', 'heat-vis')
+VIDEO_FN = os.path.join(SAVE_DIR, 'heatmap.mp4')
 
 
 class MidpointNormalize(colors.Normalize):
@@ -31,7 +40,7 @@ def _load_price_data(symbols):
     for sym in symbols:
         df = download_prices(sym).set_index('date')
         df = df[['lg_tclose_tmclose']]
-        df = df.rename(columns={'lg_yclose_tclose': sym})
+        df = df.rename(columns={'lg_tclose_tmclose': sym})
         if df_all is None:
             df_all = df
         else:
@@ -42,7 +51,12 @@ def _load_price_data(symbols):
     return dates, df_all
 
 
-def _gen_frame(date_idx, date, prices, rembs, blur=25):
+def _setup_worker(specs, dates, blur, size, dpi):
+    shms, arrays = attach_arrays(specs)
+    return dict(arrays, shms=shms, dates=dates, blur=blur, size=size, dpi=dpi)
+
+
+def _frame_grid(date_idx, prices, rembs, blur=25):
 
     # bounds for centering
     xmin, xmax = rembs[:, 0].min(), rembs[:, 0].max()
@@ -70,25 +84,80 @@ def _gen_frame(date_idx, date, prices, rembs, blur=25):
     # cool effect
     if blur > 0:
         grid = gaussian_filter(grid, sigma=blur)
-
-    plt.rcParams["figure.figsize"] = (20, 20)
-    frame = plt.gca()
-    frame.axes.xaxis.set_ticklabels([])
-    frame.axes.yaxis.set_ticklabels([])
-    plt.title(date)
-    plt.imshow(grid, cmap=plt.cm.RdBu, interpolation='nearest', norm=MidpointNormalize(midpoint=0.))
-    plt.savefig(os.path.join(SAVE_DIR, '{:05d}.png'.format(date_idx)))
-
-
-def heatmap_vis(embs_substring, **kwargs):
-
-    comp_embs_fn = None
-    for fn in COMP_EMBS_FNS:
-        if embs_substring in fn:
-            comb_embs_fn = fn
-            break
-
-    embs = np.load(comb_embs_fn)
+    return grid
+
+
+def _gen_frame(date_idx):
+
+    # a (size * dpi, size * dpi, 3) uint8 frame, drawn on its own Agg figure
+    # instead of the global pyplot one so nothing carries over between frames
+    grid = _frame_grid(date_idx, WORKER['prices'], WORKER['rembs'], blur=WORKER['blur'])
+    fig = Figure(figsize=(WORKER['size'], WORKER['size']), dpi=WORKER['dpi'])
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.gca()
+    ax.xaxis.set_ticklabels([])
+    ax.yaxis.set_ticklabels([])
+    ax.set_title(WORKER['dates'][date_idx])
+    ax.imshow(grid, cmap=cm.RdBu, interpolation='nearest', norm=MidpointNormalize(midpoint=0.))
+    canvas.draw()
+    frame = np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+    fig.clf()
+    return frame
+
+
+def _open_encoder(video_fn, width, height, fps):
+    # raw rgb24 frames on stdin, h264 out
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-',
+        '-c:v', 'libx264', '-vf', 'format=yuv420p', video_fn
+    ]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+
+def render_video(dates, prices, rembs, video_fn, fps=10, blur=25, size=20, dpi=100, procs=MAX_PROCS, max_pending=None):
+
+    # frames render across the pool and go to ffmpeg in order, at most
+    # max_pending of them are rendered or in flight at once
+    max_pending = 2 * procs if max_pending is None else max_pending
+    shms, specs = share_arrays({
+        'prices': np.ascontiguousarray(prices, dtype=np.float64),
+        'rembs': np.ascontiguousarray(rembs, dtype=np.float64)
+    })
+    encoder = None
+    start_time = time.time()
+    try:
+        with worker_pool(procs, _setup_worker, (specs, dates, blur, size, dpi), spawn=True, shms=shms) as pool:
+            pending = deque()
+            todo = iter(range(len(dates)))
+            for date_idx in itertools.islice(todo, max_pending):
+                pending.append(pool.apply_async(_gen_frame, (date_idx,)))
+            for _ in tqdm.tqdm(range(len(dates))):
+                frame = pending.popleft().get()
+                for date_idx in itertools.islice(todo, 1):
+                    pending.append(pool.apply_async(_gen_frame, (date_idx,)))
+                if encoder is None:
+                    encoder = _open_encoder(video_fn, frame.shape[1], frame.shape[0], fps)
+                encoder.stdin.write(frame.tobytes())
+    finally:
+        if encoder is not None:
+            try:
+                encoder.stdin.close()
+            except BrokenPipeError:
+                # ffmpeg already exited, its return code says why
+                pass
+            encoder.wait()
+    secs = time.time() - start_time
+    print('Wrote {} frames to {} in {:.1f}s ({:.1f} frames/sec)'.format(len(dates), video_fn, secs, len(dates) / secs))
+    if encoder is not None and encoder.returncode != 0:
+        raise RuntimeError('ffmpeg exited with {}'.format(encoder.returncode))
+
+
+def heatmap_vis(embs_substring, video_fn=VIDEO_FN, **kwargs):
+
+    comp_embs_fn = sql_find_model(embs_substring)['embs_path']
+
+    embs = np.load(comp_embs_fn)
     rembs = reduce_embs(embs)[1]
     with open(COMP_MAP_FN, 'rb') as f:
         sym_to_idx = pickle.load(f)
@@ -103,21 +172,20 @@ def heatmap_vis(embs_substring, **kwargs):
             pass
 
     print('Loaded', len(sym_to_idx), 'companies, using', len(symbols))
-    print('Saving frames to', SAVE_DIR)
 
     dates, df = _load_price_data(symbols)
     print('From', dates[0], 'to', dates[-1])
 
+    # symbols without enough history were dropped, line the embeddings up
+    # with the price columns that are left
+    rembs = rembs[[sym_to_idx[sym] for sym in df.columns]]
+
     prices = df.to_numpy()
     prices = (prices - prices.mean(axis=0)) / prices.std(axis=0)
 
     mkdir(SAVE_DIR)
-
-    for date_idx, date in tqdm.tqdm(enumerate(dates), total=len(dates)):
-        _gen_frame(date_idx, date, prices, rembs, **kwargs)
-
-    print('Done. Combine with $ ffmpeg -r 10 -i \'%5d.png\' -c:v libx264 -vf format=yuv420p heatmap.mp4')
+    render_video(dates, prices, rembs, video_fn, **kwargs)
 
 
 if __name__ == '__main__':
-    heatmap_vis('counts-content-keras-1024-3')
\ No newline at end of file
+    heatmap_vis('counts-content-keras-1024-3')
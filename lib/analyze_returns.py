@@ -1,63 +1,54 @@
+from backtest_sweep import load_feeds, sweep_returns
+from dataset.config import MAX_PROCS
+from dataset.util import sql_read_models
+from sentiment.store import SentimentStore, list_stores
 import backtrader as bt
 import pandas as pd
 import numpy as np
 import random
-import tqdm
 import os
 
 from collections import defaultdict
 from datetime import datetime
 
 
-def _parse_rsentiment_data_and_make_strat(symbol, adjusted=True):
+class RSData(bt.feeds.PandasData):
 
-    data_fn = 'prices-by-date-{}.csv'.format(symbol)
-    if not adjusted:
-        data_fn = 'unadjusted-' + data_fn
+    # price bars plus the signal, already aligned to the bars by align_signals
+    lines = ('rs',)
+    params = (('rs', -1),)
+    datafields = bt.feeds.PandasData.datafields + ['rs']
 
-    rs_df = pd.read_csv(os.path.join('data', data_fn))
-    drop_cols = [
-        'Unnamed: 0', 'low', 'close', 'volume', 'lg_close', 'lg_open', 'lg_yopen_to_yclose',
-        'lg_topen_to_tclose', 'lg_tmopen_to_tmclose', 'lg_yclose_tclose',
-        'lg_tclose_tmclose', 'open', 'high'
-    ]
-    for c in rs_df.columns:
-        if '_cumsum' in c:
-            drop_cols.append(c)
-    rs_df = rs_df.drop(columns=drop_cols).set_index('date')
 
-    class RSSignal(bt.Indicator):
-    
-        lines = ('rs',)
-        params = (('method', None),)
-            
-        def next(self):
-            ticker = self.data._name
-            date = self.data.datetime.date()
-            date_formatted = date.isoformat()[:10]
-            try:
-                val = rs_df.loc[date_formatted][self.p.method]
-                self.l.rs[0] = val
-            except Exception as e:
-                self.l.rs[0] = 0
-                
-        def _plotinit(self):
-            self.plotinfo.plotyhlines = [0]
-
-    class RSStrat(bt.Strategy):
-    
-        params = (('thresh', 0.0), ('multiplier', 1), ('method', None))
-        
-        def __init__(self):
-            self.signal = RSSignal(self.data0, method=self.p.method)
-                
-        def next(self):
-            target = 0
-            if self.signal[0] * self.p.multiplier > self.p.thresh:
-                target = 1
-            self.order_target_percent(data=self.data0, target=target)
+class RSSignal(bt.Indicator):
+
+    lines = ('rs',)
+
+    def __init__(self):
+        self.l.rs = self.data.rs
+
+    def _plotinit(self):
+        self.plotinfo.plotyhlines = [0]
+
+
+class RSStrat(bt.Strategy):
+
+    params = (('thresh', 0.0), ('multiplier', 1), ('method', None))
+
+    def __init__(self):
+        self.signal = RSSignal(self.data0)
+
+    def next(self):
+        target = 0
+        if self.signal[0] * self.p.multiplier > self.p.thresh:
+            target = 1
+        self.order_target_percent(data=self.data0, target=target)
 
-    return rs_df, list(rs_df.columns), RSSignal, RSStrat
+
+def _make_feed(bars, rs=None):
+    df = bars.set_index(pd.to_datetime(bars['date']))[['open', 'high', 'low', 'close', 'volume']].copy()
+    df['rs'] = 0.0 if rs is None else rs
+    return RSData(dataname=df)
 
 
 class LongStrat(bt.Strategy):
@@ -83,12 +74,10 @@ class RandomStrat(bt.Strategy):
         self.order_target_percent(data=self.data0, target=target)
 
 
-def _simulate_return(sym, strat, start, end, show=False, **kwargs):
+def _simulate_return(sym, strat, bars, rs=None, show=False, **kwargs):
+    # bars from backtest.load_bars, rs one aligned signal value per bar
     cerebro = bt.Cerebro()
-    feed = bt.feeds.GenericCSVData(dataname='data/PRICE_{}.csv'.format(sym),
-        dtformat="%Y-%m-%d", openinterest=-1,
-        fromdate=start, todate=end)
-    cerebro.adddata(feed, name=sym)
+    cerebro.adddata(_make_feed(bars, rs=rs), name=sym)
     cerebro.addstrategy(strat, **kwargs)
     cerebro.addanalyzer(bt.analyzers.Returns)
     run = cerebro.run()[0]
@@ -98,50 +87,56 @@ def _simulate_return(sym, strat, start, end, show=False, **kwargs):
     return data['rtot']
 
 
-def analyze_returns(symbol, start, end, adjusted=True, show=False):
+def _signal_sources():
+    # signal column name -> (registry row, sentiment store meta), the names
+    # are RSentimentScore.get_id()'s, the row is None for unadjusted signals
+    stores = {os.path.basename(sent_dir): SentimentStore.open(sent_dir).meta for sent_dir in list_stores()}
+    sources = {}
+    for model in [None] + sql_read_models():
+        relv_id = 'none' if model is None else os.path.splitext(os.path.basename(model['path']))[0]
+        for store_id, meta in stores.items():
+            sources[relv_id + '-' + store_id] = (model, meta)
+    return sources
+
+
+def analyze_returns(symbol, start, end, adjusted=True, show=False, missing='zero', procs=MAX_PROCS):
 
     print('Simulating', symbol, start, end)
 
-    rs_df, methods, RSSignal, RSStrat = \
-        _parse_rsentiment_data_and_make_strat(symbol, adjusted=adjusted)
-    
-    data = {}
-    mx = -9e9
-    for method in tqdm.tqdm(methods):
-        for thresh in [-0.075, 0.0, 0.075]:
-            for multi in [-1, 1]:
-                exp_id = (method, thresh, multi)
-                if exp_id in data:
-                    continue
-                ret = _simulate_return(symbol, RSStrat, start, end, 
-                    method=method, multiplier=multi, thresh=thresh)
-                mx = max(mx, ret)
-                data[exp_id] = ret
+    feeds = load_feeds([symbol], start, end, adjusted=adjusted, missing=missing)
+    bars, methods, signals = feeds[symbol]
+
+    # the whole (method, thresh, multi) grid and the baselines, same rtot as RSStrat
+    table = sweep_returns(feeds, adjusted=adjusted, procs=procs, fn=None)
+    grid = table[~table['method'].isin(['long', 'rand'])]
+    data = dict(zip(zip(grid['method'], grid['thresh'], grid['multiplier']), grid['rtot']))
 
     results = defaultdict(list)
     best_result = list(data.keys())[0]
 
     print('Aggregating', len(data), 'results...')
 
+    sources = _signal_sources()
     for (name, thresh, multi), ret in data.items():
         temp, mod = (name.split('_') + [""])[:2]
-        ids = temp.split('-')
-        if adjusted:
-            a_method = ids[6]
-            a_type = ids[7]
-            c_num_emb = int(ids[9])
-            c_num_hidden = int(ids[10])
-            c_acc = float(ids[12])
-            s_method = ids[16]
-            s_type = ids[17]
+        if temp not in sources:
+            raise Exception('No registered model and sentiment store for {}, run '
+                'register_legacy_models() for models saved before the table existed.'.format(temp))
+        model, sent_meta = sources[temp]
+        if model is not None:
+            # art_exp_id is article-embs-<ds_name>-<method>-<type>
+            a_method, a_type = model['art_exp_id'].split('-', 4)[3:]
+            c_num_emb = model['params']['latent_size']
+            c_num_hidden = model['params']['post_emb_layers']
+            c_acc = model['val_accuracy']
         else:
             a_method = 'none'
             a_type = 'none'
             c_num_emb = 0
             c_num_hidden = 0
             c_acc = 0
-            s_method = ids[4]
-            s_type = ids[5]
+        s_method = sent_meta['method']
+        s_type = sent_meta['field']
         results['0-a_method-' + a_method].append(ret)
         results['1-s_method-' + s_method].append(ret)
         results['2-a_type-' + a_type].append(ret)
@@ -149,11 +144,9 @@ def analyze_returns(symbol, start, end, adjusted=True, show=False):
         results['4-c_num_emb-' + str(c_num_emb)].append(ret)
         if ret > data[best_result]:
             best_result = (name, thresh, multi)
-    results['5-long'] = _simulate_return(symbol, LongStrat, start, end)
-    results['6-rand'] = np.median([
-        _simulate_return(symbol, RandomStrat, start, end)
-        for _ in range(20) 
-    ])
+    results['5-long'] = table.loc[table['method'] == 'long', 'rtot'].iloc[0]
+    rand = table.loc[table['method'] == 'rand', 'rtot']
+    results['6-rand'] = np.median(rand)
 
     print(symbol)
     print('-'*20)
@@ -161,9 +154,13 @@ def analyze_returns(symbol, start, end, adjusted=True, show=False):
         print(k, int(round(np.max(results[k]) * 100)))
     print('-'*20)
 
-    print('Best', best_result)
-    _simulate_return(symbol, RSStrat, start, end, show=show, 
-        method=best_result[0], 
+    print('Random', len(rand), 'paths, rtot percentiles', dict(zip(
+        [5, 25, 50, 75, 95], np.round(np.percentile(rand, [5, 25, 50, 75, 95]) * 100).astype(int))))
+    best_row = grid[(grid['method'] == best_result[0]) & (grid['thresh'] == best_result[1]) &
+        (grid['multiplier'] == best_result[2])].iloc[0]
+    print('Best', best_result, 'beats {:.1f}% of random paths'.format(best_row['rand_pct']))
+    _simulate_return(symbol, RSStrat, bars, rs=signals[:, methods.index(best_result[0])], show=show,
+        method=best_result[0],
         thresh=best_result[1], 
         multiplier=best_result[2])
 
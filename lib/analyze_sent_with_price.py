@@ -1,133 +1,168 @@
-from dataset.util import sql_read_articles, mkdir, download_prices
-from sentiment.articles import load_sentiment
-from keras.models import load_model
+from dataset.util import (
+    sql_read_articles, sql_read_article_dates, sql_find_models, mkdir, download_prices, worker_pool, WORKER
+)
+from dataset.config import MAX_PROCS
+from sentiment.store import SentimentStore, list_stores
+from sentiment.daily import daily_means, daily_relevance_sentiment
+from sentiment.features import make_features, corr_block, lagged_corr, rolling_corr
+from sentiment.online import OnlineFeatures
+from dataset.corpus import CorpusIndex, Grouping
+from embs.relevance import (
+    RelevanceScorer, scorer_fn, relevance_matrix_fn,
+    bake_relevance_matrix, load_relevance_matrix, relevance_matrix_size
+)
 from collections import defaultdict
+from contextlib import nullcontext
 import plotly.express as px
 import pandas as pd
 import numpy as np
 import pickle
-import tqdm
 import glob
 import os
 
 
-RELV_MODELS = glob.glob(os.path.join('data', 'company-embs-*-article-embs-*-*-*-*-*-*.h5'))
 COMP_MAP_FN = glob.glob(os.path.join('data', 'company-embs-*-map.pkl'))[0]
-SENTIMENT_FNS = glob.glob(os.path.join('data', 'article-sentiment-*-*-*.npy'))
+SENTIMENT_DIRS = list_stores()
+CORR_LAGS = [-5, -3, -1, 0, 1, 3, 5]
+ROLLING_CORR_COL = 'lg_tclose_tmclose'
+ROLLING_CORR_WIN = 30
+ONLINE_DIR = os.path.join('data', 'online')
+# bump when the cached daily scores change meaning, v2 is mean(s * r) over
+# sentiment read pre-standardized from data/sentiment, v1 files in
+# data/plot_ckpt are never read
+PLOT_CKPT_DIR = os.path.join('data', 'plot_ckpt', 'v2')
 
 
 class RSentimentScore:
 
-    def __init__(self, sym_to_idx, relv_model_fn, sent_fn):
+    def __init__(self, sym_to_idx, relv_model, sent_dir):
+        # relv_model is a row from the model registry, None for sentiment only
         self.sym_to_idx = sym_to_idx
-        self.relv_model_fn = relv_model_fn
-        self.sent_fn = sent_fn
-        self.art_embs_fn = os.path.join('data', '-'.join(
-            os.path.basename(relv_model_fn).split('-')[3:-5]) + '.npy')
-
-    def load(self):
-        self.model = load_model(self.relv_model_fn)
-        self.art_embs = np.load(self.art_embs_fn)
-        self.load_sent()
-    
-    def load_sent(self):
-        self.sent = load_sentiment(self.sent_fn)
-
-    def score(self, symbol, art_idxs):
+        self.relv_model = relv_model
+        self.sent_dir = sent_dir
+        if relv_model is not None:
+            self.relv_model_fn = relv_model['path']
+            self.art_embs_fn = relv_model['art_embs_path']
+        else:
+            self.relv_model_fn = 'none'
 
-        sentiment = self.sent[art_idxs]
-        article_embs = self.art_embs[art_idxs]
+    def bake_relevance(self):
+        # baked, or extended to the articles added to the embeddings since
+        relv_fn = relevance_matrix_fn(self.relv_model_fn)
+        art_embs = np.load(self.art_embs_fn, mmap_mode='r')
+        if relevance_matrix_size(relv_fn) < len(art_embs):
+            scorer = RelevanceScorer.load(scorer_fn(self.relv_model_fn))
+            bake_relevance_matrix(scorer, art_embs, relv_fn)
+        return relv_fn
 
-        # b/c gcp sent scores somewhat broken
-        valid_sent_idxs = (sentiment != -1000)  
-        sentiment = sentiment[valid_sent_idxs]
-        article_embs = article_embs[valid_sent_idxs]
+    def load(self, sent=None):
+        # (symbols x articles), shared by every sentiment file
+        self.relv = load_relevance_matrix(self.bake_relevance())
+        self.load_sent(sent=sent)
+    
+    def load_sent(self, sent=None):
+        # sent is an open SentimentStore, both arrays are memmapped
+        if sent is None:
+            sent = SentimentStore.open(self.sent_dir)
+        self.sent = sent.std
+        self.valid = sent.valid
 
-        symbol_idxs = [self.sym_to_idx[symbol]] * len(article_embs)
+    def score(self, symbols, by_date, dates):
+        # (len(symbols), len(dates)) daily means of relevance * sentiment,
+        # only by_date's articles are read from the memmapped arrays
+        sym_idxs = [self.sym_to_idx[sym] for sym in symbols]
+        rows = by_date.rows
+        return daily_relevance_sentiment(self.relv[np.ix_(sym_idxs, rows)], self.sent[rows], self.valid[rows],
+            by_date.compact(), dates=dates)
 
-        relv = self.model.predict([symbol_idxs, article_embs])
-        relv_sentiment = sentiment * relv
-        return np.mean(relv_sentiment)
+    def sent_only_score(self, by_date, dates):
+        return daily_means(self.sent, self.valid, by_date, dates=dates)
 
-    def sent_only_score(self, symbol, art_idxs):
-        if len(art_idxs) == 0:
-            return 0
-        sentiment = self.sent[art_idxs]
-        valid_sent_idxs = (sentiment != -1000)  
-        sentiment = sentiment[valid_sent_idxs]
-        return np.mean(sentiment)
+    def check_size(self, n_articles):
+        # both are indexed by position in sql_read_articles(only_labeled=True),
+        # the extend commands append the articles added since they were baked
+        if self.relv.shape[1] != n_articles or len(self.sent) != n_articles:
+            raise Exception('{} covers {} articles and {} covers {}, the database has {}. Run '
+                '"python gen_article_embs.py extend", "python gen_sentiment.py extend" and '
+                '"python gen_relevance.py" to add the new ones.'.format(relevance_matrix_fn(self.relv_model_fn),
+                self.relv.shape[1], self.sent_dir, len(self.sent), n_articles))
 
     def get_id(self):
         return os.path.splitext(os.path.basename(self.relv_model_fn))[0] \
-            + '-' + os.path.splitext(os.path.basename(self.sent_fn))[0]
+            + '-' + os.path.basename(self.sent_dir)
 
 
-def analyze_sent_scores(symbol, adjusted=True, plot=True):
+def _in_range(date):
+    return date.startswith('2019') or date.startswith('2020')
 
-    print('Analyzing', symbol, 'sentiment...')
 
-    mkdir(os.path.join('data', 'plot_ckpt'))
+def _setup_worker(sym_to_idx, by_date, dates):
+    return {'sym_to_idx': sym_to_idx, 'by_date': by_date, 'dates': dates}
 
-    articles = sql_read_articles(only_labeled=True)
-    article_idxs_by_date = defaultdict(list)
-    arts_cnt = 0
-    for i, article in enumerate(articles):
-        if not adjusted and article[1] != symbol:
-            continue
-        article_idxs_by_date[article[3]].append(i)
-        arts_cnt += 1
-    dates = sorted(article_idxs_by_date)
-    dates = [d for d in dates if d.startswith('2019') or d.startswith('2020')]
 
-    print('Using', arts_cnt, 'articles.')
+def _score_pair(args):
+    # one (relevance model, sentiment store) pair for the symbols not cached yet
+    relv_model, sent_dir, ckpt_fns = args
+    RS = RSentimentScore(WORKER['sym_to_idx'], relv_model, sent_dir)
+    RS.load()
+    todo = list(ckpt_fns)
+    for sym, scores in zip(todo, RS.score(todo, WORKER['by_date'], WORKER['dates'])):
+        np.save(ckpt_fns[sym], scores)
+    return RS.get_id(), len(todo)
 
-    with open(COMP_MAP_FN, 'rb') as f:
-        sym_to_idx = pickle.load(f)
 
-    plot_data = defaultdict(list)
-    plot_data['date'] = dates
+def _adjusted_scores(symbols, sym_to_idx, by_date, dates, pool=None):
+    plot_data = {sym: {'date': dates} for sym in symbols}
     names = []
-    if adjusted:
-        # compute relevant sentiment
-        for relv_model_fn in RELV_MODELS:
-            for sentiment_fn in SENTIMENT_FNS:
-                RS = RSentimentScore(sym_to_idx, relv_model_fn, sentiment_fn)
-                name = RS.get_id()
-                names.append(name)
-                ckpt_fn = os.path.join('data', 'plot_ckpt', symbol + '-' + name + '.npy')
-                if not os.path.exists(ckpt_fn):
-                    print('Computing', name)
-                    RS.load()
-                    scores = []
-                    for date in tqdm.tqdm(dates):
-                        score = RS.score(symbol, article_idxs_by_date[date])
-                        scores.append(score)
-                    np.save(ckpt_fn, scores)
-                else:
-                    print('Already computed...skipping.')
-                    scores = list(np.load(ckpt_fn))
-                plot_data[name] = scores
-    else:
-        # just average sentiment
-        for sentiment_fn in SENTIMENT_FNS:
-            RS = RSentimentScore(sym_to_idx, 'none', sentiment_fn)
+    tasks = []
+    for relv_model in sql_find_models():
+        for sent_dir in SENTIMENT_DIRS:
+            RS = RSentimentScore(sym_to_idx, relv_model, sent_dir)
             name = RS.get_id()
             names.append(name)
-            print('Computing', name)
-            RS.load_sent()
-            scores = []
-            for date in tqdm.tqdm(dates):
-                score = RS.sent_only_score(symbol, article_idxs_by_date[date])
-                scores.append(score)
-            plot_data[name] = scores
+            ckpt_fns = {sym: os.path.join(PLOT_CKPT_DIR, sym + '-' + name + '.npy') for sym in symbols}
+            todo = {sym: fn for sym, fn in ckpt_fns.items() if not os.path.exists(fn)}
+            if len(todo) > 0:
+                # baked here, pairs sharing a model must not write it at once
+                RS.bake_relevance()
+                tasks.append((relv_model, sent_dir, todo))
+            else:
+                print('Already computed', name, '...skipping.')
+
+    # the pairs are independent, each worker memmaps its own matrix and store
+    results = pool.imap_unordered(_score_pair, tasks) if pool is not None else map(_score_pair, tasks)
+    for name, n_syms in results:
+        print('Computed', name, 'for', n_syms, 'symbols')
+
+    for name in names:
+        for sym in symbols:
+            plot_data[sym][name] = np.load(os.path.join(PLOT_CKPT_DIR, sym + '-' + name + '.npy'))
+    return plot_data, names
+
+
+def _unadjusted_scores(symbols, sym_to_idx, corpus, sents):
+    RSs = []
+    for sent_dir in SENTIMENT_DIRS:
+        RS = RSentimentScore(sym_to_idx, None, sent_dir)
+        RS.load_sent(sent=sents[sent_dir])
+        RSs.append(RS)
+    plot_data = {}
+    for sym in symbols:
+        by_date = corpus.dates.subset(corpus.symbols[sym])
+        dates = [d for d in by_date if _in_range(d)]
+        print('Using', len(by_date.rows), 'articles for', sym)
+        plot_data[sym] = {'date': dates}
+        for RS in RSs:
+            plot_data[sym][RS.get_id()] = RS.sent_only_score(by_date, dates)
+    return plot_data, [RS.get_id() for RS in RSs]
+
+
+def _save_symbol_outputs(symbol, plot_data, names, adjusted, plot):
 
     prices = download_prices(symbol)
     df = pd.DataFrame(plot_data)
-    for name in names:
-        for win in [5, 7, 10, 30]:
-            df[name + '_emw' + str(win)] = df[name].ewm(span=win).mean()
-            df[name + '_ma' + str(win)] = df[name].rolling(win).mean()
-        df[name + '_cumsum'] = df[name].cumsum()
+    features, feature_cols = make_features(df[names].to_numpy(), names)
+    df = pd.concat([df, pd.DataFrame(features, columns=feature_cols)], axis=1)
 
     save_fn_prefix = ''
     if not adjusted:
@@ -136,9 +171,24 @@ def analyze_sent_scores(symbol, adjusted=True, plot=True):
     df_corr = df.merge(prices, on='date')
     df_corr.to_csv(os.path.join('data', save_fn_prefix + 'prices-by-date-' + symbol + '.csv'))
 
+    # only the (everything x price) block of the full correlation matrix
     price_cols = [c for c in prices.columns if c != 'date']
-    corr_table = df_corr.corr()
-    corr_table[price_cols].to_csv(os.path.join('data', save_fn_prefix + 'price-corr-' + symbol + '.csv'))
+    corr_cols = [c for c in df_corr.columns if c != 'date']
+    signal_cols = [c for c in corr_cols if c not in price_cols]
+    X = df_corr[corr_cols].to_numpy(dtype=np.float64)
+    Y = df_corr[price_cols].to_numpy(dtype=np.float64)
+    corr_table = pd.DataFrame(corr_block(X, Y), index=corr_cols, columns=price_cols)
+    corr_table.to_csv(os.path.join('data', save_fn_prefix + 'price-corr-' + symbol + '.csv'))
+
+    X = df_corr[signal_cols].to_numpy(dtype=np.float64)
+    lagged = lagged_corr(X, Y, CORR_LAGS)
+    lagged_table = pd.DataFrame(lagged.reshape(-1, len(price_cols)), columns=price_cols,
+        index=pd.MultiIndex.from_product([CORR_LAGS, signal_cols], names=['lag', 'signal']))
+    lagged_table.to_csv(os.path.join('data', save_fn_prefix + 'price-corr-lagged-' + symbol + '.csv'))
+
+    rolling = rolling_corr(X, df_corr[ROLLING_CORR_COL].to_numpy(dtype=np.float64), ROLLING_CORR_WIN)
+    rolling_table = pd.DataFrame(rolling, index=df_corr['date'], columns=signal_cols)
+    rolling_table.to_csv(os.path.join('data', save_fn_prefix + 'price-corr-rolling-' + symbol + '.csv'))
 
     if plot:
         df_plot = df.merge(prices[['date', 'lg_topen_to_tclose']], on='date')
@@ -147,5 +197,108 @@ def analyze_sent_scores(symbol, adjusted=True, plot=True):
         fig.show()
 
 
+def analyze_sent_scores_multi(symbols, adjusted=True, plot=False, procs=MAX_PROCS):
+
+    print('Analyzing', len(symbols), 'symbols sentiment...')
+
+    mkdir(PLOT_CKPT_DIR)
+
+    # everything shared is loaded once for the whole symbol list
+    corpus = CorpusIndex(sql_read_articles(only_labeled=True))
+    with open(COMP_MAP_FN, 'rb') as f:
+        sym_to_idx = pickle.load(f)
+    by_date = corpus.dates
+    dates = [d for d in by_date if _in_range(d)]
+    print('Using', len(by_date.rows), 'articles.')
+
+    # one pool for the scoring and the per symbol outputs
+    worker_args = (sym_to_idx, by_date, dates)
+    if procs > 1:
+        pool_ctx = worker_pool(procs, _setup_worker, worker_args, spawn=True)
+    else:
+        WORKER.update(_setup_worker(*worker_args))
+        pool_ctx = nullcontext()
+    with pool_ctx as pool:
+        if adjusted:
+            plot_data, names = _adjusted_scores(symbols, sym_to_idx, by_date, dates, pool=pool)
+        else:
+            sents = {sent_dir: SentimentStore.open(sent_dir) for sent_dir in SENTIMENT_DIRS}
+            plot_data, names = _unadjusted_scores(symbols, sym_to_idx, corpus, sents)
+
+        params = [(sym, plot_data[sym], names, adjusted, plot) for sym in symbols]
+        if pool is not None and len(symbols) > 1:
+            pool.starmap(_save_symbol_outputs, params)
+        else:
+            for args in params:
+                _save_symbol_outputs(*args)
+
+
+def _online_scores(symbols, sym_to_idx, since):
+    # (symbols, days, names) scores for the days from since on, only those
+    # articles' dates are read, the relevance and sentiment arrays have to
+    # cover every labeled article
+    positions, art_dates, n_articles = sql_read_article_dates(only_labeled=True, since=since)
+    by_date = Grouping(art_dates, rows=positions)
+    dates = list(by_date)
+    names = []
+    scores = []
+    for relv_model in sql_find_models():
+        for sent_dir in SENTIMENT_DIRS:
+            RS = RSentimentScore(sym_to_idx, relv_model, sent_dir)
+            names.append(RS.get_id())
+            RS.load()
+            RS.check_size(n_articles)
+            scores.append(RS.score(symbols, by_date, dates))
+    scores = np.stack(scores, axis=2) if len(scores) > 0 else np.zeros((len(symbols), len(dates), 0))
+    return dates, names, scores
+
+
+def update_sent_scores(symbols):
+
+    # appends only days since each symbol's saved state. the last ingested
+    # day is scored and applied again, so articles that arrive late for it
+    # replace its row instead of being dropped, anything older is final
+    mkdir(ONLINE_DIR)
+
+    with open(COMP_MAP_FN, 'rb') as f:
+        sym_to_idx = pickle.load(f)
+
+    state_fns = {sym: os.path.join(ONLINE_DIR, sym + '.npz') for sym in symbols}
+    states = {sym: OnlineFeatures.load(fn) for sym, fn in state_fns.items() if os.path.exists(fn)}
+    # symbols without state need the whole history, the rest only the new days
+    groups = defaultdict(list)
+    for sym in symbols:
+        last_date = states[sym].last_date if sym in states else None
+        groups['new' if last_date is None else 'old'].append(sym)
+
+    for group, group_syms in groups.items():
+        since = None if group == 'new' else min(states[sym].last_date for sym in group_syms)
+        dates, names, scores = _online_scores(group_syms, sym_to_idx, since)
+        print('Updating', len(group_syms), group, 'symbols over', len(dates), 'days')
+
+        for i, sym in enumerate(group_syms):
+            state = states.get(sym, OnlineFeatures(names))
+            if state.names != names:
+                raise Exception('Models changed for ' + sym + ', delete ' + state_fns[sym] + ' to rebuild.')
+            last_date = state.last_date
+            new_dates, features = state.update(dates, scores[i])
+            df = pd.DataFrame(features, columns=state.columns())
+            df.insert(0, 'date', new_dates)
+            for j, name in enumerate(names):
+                df.insert(1 + j, name, scores[i, len(dates) - len(new_dates):, j])
+            live_fn = os.path.join(ONLINE_DIR, 'sent-' + sym + '.csv')
+            if len(new_dates) > 0 and new_dates[0] == last_date and os.path.exists(live_fn):
+                # the last day was applied again, its old row goes
+                live = pd.read_csv(live_fn, dtype={'date': str})
+                live[live['date'] != last_date].to_csv(live_fn, index=False)
+            df.to_csv(live_fn, mode='a', header=not os.path.exists(live_fn), index=False)
+            state.save(state_fns[sym])
+
+
+def analyze_sent_scores(symbol, adjusted=True, plot=True):
+    print('Analyzing', symbol, 'sentiment...')
+    analyze_sent_scores_multi([symbol], adjusted=adjusted, plot=plot, procs=1)
+
+
 if __name__ == "__main__":
     analyze_sent_scores('NFLX', adjusted=True, plot=False)
@@ -0,0 +1,222 @@
+from datetime import datetime, time
+import pandas as pd
+import numpy as np
+import os
+
+
+START_CASH = 10000.0
+THRESHS = [-0.075, 0.0, 0.075]
+MULTIPLIERS = [-1, 1]
+# backtrader stamps daily bars with the end of the session
+SESSION_END = time(23, 59, 59, 999989)
+
+
+def load_signals(symbol, adjusted=True, folder='data'):
+
+    data_fn = 'prices-by-date-{}.csv'.format(symbol)
+    if not adjusted:
+        data_fn = 'unadjusted-' + data_fn
+
+    # the prices-by-date csv analyze_sent_with_price writes, minus the price columns
+    rs_df = pd.read_csv(os.path.join(folder, data_fn))
+    drop_cols = [
+        'Unnamed: 0', 'low', 'close', 'volume', 'lg_close', 'lg_open', 'lg_yopen_to_yclose',
+        'lg_topen_to_tclose', 'lg_tmopen_to_tmclose', 'lg_yclose_tclose',
+        'lg_tclose_tmclose', 'open', 'high'
+    ]
+    for c in rs_df.columns:
+        if '_cumsum' in c:
+            drop_cols.append(c)
+    rs_df = rs_df.drop(columns=drop_cols).set_index('date')
+
+    return rs_df, list(rs_df.columns)
+
+
+def load_bars(sym, start, end, folder='data'):
+    # the bars GenericCSVData(fromdate=start, todate=end) would feed
+    df = pd.read_csv(os.path.join(folder, 'PRICE_{}.csv'.format(sym)))
+    if not isinstance(start, datetime):
+        start = datetime.combine(start, time.min)
+    if not isinstance(end, datetime):
+        end = datetime.combine(end, time.max)
+    bar_dts = pd.to_datetime(df['date']) + pd.to_timedelta(SESSION_END.isoformat())
+    df = df[(bar_dts >= start) & (bar_dts <= end)].reset_index(drop=True)
+    return df
+
+
+def align_signals(rs_df, methods, dates, missing='zero'):
+    # (n_days, n_methods) signal values for the price bars' dates. missing
+    # says what days absent from rs_df read as, 'zero' (what RSSignal always
+    # did), 'nan' (never trades) or 'ffill' (last known value), nan values
+    # in rs_df stay nan and never clear a threshold
+    aligned = rs_df[methods].reindex(dates)
+    absent = ~pd.Index(dates).isin(rs_df.index)
+    values = aligned.to_numpy(dtype=np.float64)
+    if missing == 'zero':
+        values[absent] = 0
+    elif missing == 'ffill':
+        filled = rs_df[methods].reindex(rs_df.index.union(dates)).ffill().reindex(dates)
+        values[absent] = filled.to_numpy(dtype=np.float64)[absent]
+    elif missing != 'nan':
+        raise ValueError(missing)
+    return values
+
+
+def grid_targets(signals, threshs=THRESHS, multipliers=MULTIPLIERS):
+    # (n_days, n_methods * len(threshs) * len(multipliers)) long/flat targets,
+    # columns ordered method-major like the (method, thresh, multi) loops
+    sig = signals[:, :, None, None] * np.asarray(multipliers, dtype=np.float64)[None, None, None, :]
+    with np.errstate(invalid='ignore'):
+        targets = sig > np.asarray(threshs, dtype=np.float64)[None, None, :, None]
+    return targets.reshape(len(signals), -1)
+
+
+def grid_keys(methods, threshs=THRESHS, multipliers=MULTIPLIERS):
+    return [(method, thresh, multi) for method in methods for thresh in threshs for multi in multipliers]
+
+
+def random_targets(n_days, n_draws, p=0.5, seed=None):
+    # n_draws RandomStrat style paths at once, long on each bar with probability p
+    return np.random.RandomState(seed).rand(n_days, n_draws) < p
+
+
+def percentile_rank(dist, values):
+    # percent of dist below each value, ties count half
+    dist = np.sort(np.asarray(dist, dtype=np.float64))
+    values = np.asarray(values, dtype=np.float64)
+    below = np.searchsorted(dist, values, side='left')
+    upto = np.searchsorted(dist, values, side='right')
+    return 100.0 * (below + upto) / 2 / len(dist)
+
+
+def simulate_targets(opens, closes, targets, cash=START_CASH):
+    # order_target_percent(target=0 or 1) every bar for each column of targets,
+    # same fills as backtrader's default broker: market orders fill at the
+    # next bar's open, sizes are whole shares of cash // close and a buy that
+    # costs more than the cash left at the open is rejected
+    opens = np.asarray(opens, dtype=np.float64)
+    closes = np.asarray(closes, dtype=np.float64)
+    targets = np.asarray(targets, dtype=bool).reshape(len(closes), -1)
+    n_strats = targets.shape[1]
+    cash = np.full(n_strats, cash, dtype=np.float64)
+    start_value = cash.copy()
+    shares = np.zeros(n_strats, dtype=np.float64)
+    orders = np.zeros(n_strats, dtype=np.float64)
+    values = np.empty((len(closes), n_strats))
+
+    for t in range(len(closes)):
+        if t > 0:
+            cost = orders * opens[t]
+            filled = (orders < 0) | ((orders > 0) & (cash - cost >= 0))
+            shares = np.where(filled, shares + orders, shares)
+            cash = np.where(filled, cash - cost, cash)
+
+        pos_value = shares * closes[t]
+        total = cash + pos_value
+        values[t] = total
+        buy = np.floor_divide(total - pos_value, closes[t])
+        orders = np.where(targets[t], np.where(total > pos_value, buy, 0), -shares)
+
+    rtot = np.log(values[-1] / start_value) if len(closes) > 0 else np.zeros(n_strats)
+    return rtot, values
+
+
+def run_stats(values, targets, cash=START_CASH):
+    # the analyzer style outputs for each column of simulate_targets' values
+    values = np.asarray(values, dtype=np.float64)
+    targets = np.asarray(targets, dtype=bool).reshape(values.shape)
+    log_rets = np.diff(np.log(np.vstack([np.full(values.shape[1], cash), values])), axis=0)
+    peaks = np.maximum.accumulate(values, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = log_rets.mean(axis=0) / log_rets.std(axis=0) * np.sqrt(252)
+    return {
+        'rtot': np.log(values[-1] / cash),
+        'max_drawdown': ((peaks - values) / peaks).max(axis=0),
+        'sharpe': sharpe,
+        'exposure': targets.mean(axis=0),
+        'n_switches': (targets[1:] != targets[:-1]).sum(axis=0) + targets[0]
+    }
+
+
+def backtest_grid(bars, rs_df, methods, threshs=THRESHS, multipliers=MULTIPLIERS, cash=START_CASH, missing='zero'):
+    # every RSStrat(method, thresh, multiplier) in one pass, {key: rtot}
+    signals = align_signals(rs_df, methods, bars['date'].tolist(), missing=missing)
+    targets = grid_targets(signals, threshs=threshs, multipliers=multipliers)
+    rtot, _ = simulate_targets(bars['open'], bars['close'], targets, cash=cash)
+    return dict(zip(grid_keys(methods, threshs=threshs, multipliers=multipliers), rtot))
+
+
+WEIGHTINGS = ['equal', 'signal', 'inverse_vol']
+
+
+def portfolio_weights(signals, targets, closes, weighting='equal', normalize=True, vol_window=20):
+    # (n_days, n_ports, n_symbols) target weights decided at each close.
+    # signals and targets are (n_days, n_ports, n_symbols), closes (n_days,
+    # n_symbols) with nan where a symbol has no bar. weighting scores the
+    # long symbols, 'equal' the same, 'signal' by |signal| and 'inverse_vol'
+    # by 1 / the trailing vol_window day std of log returns. normalize spreads
+    # everything over the longs, otherwise each symbol keeps the slice it
+    # would get if every symbol with a price was long and the rest is cash.
+    # on a day without a bar a symbol keeps its last bar's target and score,
+    # so the gap moves neither it nor the other weights
+    has_price = ~np.isnan(closes)
+    if weighting == 'equal':
+        score = np.ones(closes.shape)[:, None, :]
+    elif weighting == 'signal':
+        score = np.abs(np.nan_to_num(signals))
+    elif weighting == 'inverse_vol':
+        # returns across a gap are taken from the last bar before it
+        log_rets = np.log(pd.DataFrame(closes).ffill()).diff().where(has_price)
+        vol = log_rets.rolling(vol_window, min_periods=2).std().to_numpy()
+        with np.errstate(divide='ignore'):
+            score = np.where(vol > 0, 1 / vol, 0)[:, None, :]
+    else:
+        raise ValueError(weighting)
+    score = np.broadcast_to(np.where(has_price[:, None, :], score, 0), targets.shape)
+    held = np.where(targets & has_price[:, None, :], score, 0)
+    # index of each symbol's last day with a bar, -1 before its first
+    last_bar = np.maximum.accumulate(np.where(has_price, np.arange(len(closes))[:, None], -1), axis=0)
+    since_bar = np.broadcast_to(np.maximum(last_bar, 0)[:, None, :], targets.shape)
+    listed = (last_bar >= 0)[:, None, :]
+    score = np.where(listed, np.take_along_axis(score, since_bar, axis=0), 0)
+    held = np.where(listed, np.take_along_axis(held, since_bar, axis=0), 0)
+    total = held.sum(axis=2, keepdims=True) if normalize else score.sum(axis=2, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, held / total, 0)
+
+
+def simulate_portfolio(opens, closes, weights, cash=START_CASH):
+    # rebalance every portfolio to its weights each bar. opens and closes are
+    # (n_days, n_symbols), weights (n_days, n_ports, n_symbols). like
+    # order_target_percent, share targets come from the close's value and
+    # fill at the next open, but shares are fractional and instead of being
+    # rejected, buys that cost more than the cash left after the sells are
+    # scaled down to fit. symbols without a bar keep their position
+    has_bar = ~np.isnan(closes)
+    closes = pd.DataFrame(closes).ffill().to_numpy()
+    opens = np.where(np.isnan(opens), closes, opens)
+    opens, closes = np.nan_to_num(opens), np.nan_to_num(closes)
+    n_days, n_ports, n_symbols = weights.shape
+    cash = np.full(n_ports, cash, dtype=np.float64)
+    start_value = cash.copy()
+    shares = np.zeros((n_ports, n_symbols))
+    wanted = shares
+    values = np.empty((n_days, n_ports))
+
+    for t in range(n_days):
+        if t > 0:
+            delta = wanted - shares
+            cash = cash - (np.minimum(delta, 0) * opens[t]).sum(axis=1)
+            cost = (np.maximum(delta, 0) * opens[t]).sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                scale = np.where(cost > cash, np.maximum(cash, 0) / cost, 1)
+            delta = np.where(delta > 0, delta * scale[:, None], delta)
+            cash = cash - (np.maximum(delta, 0) * opens[t]).sum(axis=1)
+            shares = shares + delta
+        total = cash + (shares * closes[t]).sum(axis=1)
+        values[t] = total
+        with np.errstate(invalid='ignore', divide='ignore'):
+            wanted = np.where(has_bar[t] & (closes[t] > 0), weights[t] * total[:, None] / closes[t], shares)
+
+    rtot = np.log(values[-1] / start_value) if n_days > 0 else np.zeros(n_ports)
+    return rtot, values
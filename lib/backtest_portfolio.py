@@ -0,0 +1,96 @@
+from dataset.config import MY_SYMBOLS
+from backtest import (
+    portfolio_weights, simulate_portfolio, run_stats, START_CASH, THRESHS, MULTIPLIERS, WEIGHTINGS
+)
+from backtest_sweep import load_feeds
+from datetime import datetime
+import pandas as pd
+import numpy as np
+import os
+
+
+PORTFOLIO_FN = os.path.join('data', 'returns-portfolio.csv')
+
+
+class Panel:
+
+    # every symbol's bars and signals on one calendar, (n_days, n_symbols)
+    # price arrays and a (n_days, n_symbols) signal array per method
+    def __init__(self, feeds):
+        self.symbols = list(feeds)
+        self.dates = sorted(set(d for bars, _, _ in feeds.values() for d in bars['date']))
+        # only methods every symbol has, the ids don't depend on the symbol
+        self.methods = [m for m in feeds[self.symbols[0]][1] if all(m in f[1] for f in feeds.values())]
+        day_idx = {d: i for i, d in enumerate(self.dates)}
+        shape = (len(self.dates), len(self.symbols))
+        self.opens = np.full(shape, np.nan)
+        self.closes = np.full(shape, np.nan)
+        self._rows = []
+        self._signals = []
+        for j, (bars, methods, signals) in enumerate(feeds.values()):
+            rows = np.array([day_idx[d] for d in bars['date']], dtype=np.int64)
+            self.opens[rows, j] = bars['open']
+            self.closes[rows, j] = bars['close']
+            self._rows.append(rows)
+            self._signals.append((methods, signals))
+
+    def signals(self, method):
+        # nan on days a symbol has no bar, those never go long
+        panel = np.full(self.opens.shape, np.nan)
+        for j, (rows, (methods, signals)) in enumerate(zip(self._rows, self._signals)):
+            panel[rows, j] = signals[:, methods.index(method)]
+        return panel
+
+
+def portfolio_returns(panel, methods=None, threshs=THRESHS, multipliers=MULTIPLIERS,
+        weighting='equal', normalize=True, cash=START_CASH):
+
+    # one portfolio per (method, thresh, multi) plus a long everything one,
+    # all of a method's portfolios run through simulate_portfolio together
+    methods = panel.methods if methods is None else methods
+    threshs = np.asarray(threshs, dtype=np.float64)
+    multipliers = np.asarray(multipliers, dtype=np.float64)
+    rows = []
+
+    def add_rows(keys, signals, targets):
+        weights = portfolio_weights(signals, targets, panel.closes, weighting=weighting, normalize=normalize)
+        _, values = simulate_portfolio(panel.opens, panel.closes, weights, cash=cash)
+        stats = run_stats(values, weights.sum(axis=2) > 0, cash=cash)
+        for i, (method, thresh, multi) in enumerate(keys):
+            row = {'method': method, 'thresh': thresh, 'multiplier': multi}
+            row.update({stat: vals[i] for stat, vals in stats.items()})
+            row['mean_weight'] = weights[:, i].sum(axis=1).mean()
+            rows.append(row)
+
+    n_days, n_symbols = panel.closes.shape
+    add_rows([('long', np.nan, np.nan)], np.ones((n_days, 1, n_symbols)), np.ones((n_days, 1, n_symbols), dtype=bool))
+    for method in methods:
+        # (n_days, thresh * multi, n_symbols), ordered like grid_keys
+        sig = panel.signals(method)[:, None, None, :] * multipliers[None, None, :, None]
+        with np.errstate(invalid='ignore'):
+            targets = sig > threshs[None, :, None, None]
+        sig = np.broadcast_to(sig, targets.shape).reshape(n_days, -1, n_symbols)
+        keys = [(method, thresh, multi) for thresh in threshs for multi in multipliers]
+        add_rows(keys, sig, targets.reshape(n_days, -1, n_symbols))
+
+    table = pd.DataFrame(rows)
+    table.insert(3, 'weighting', weighting)
+    table.insert(4, 'normalize', normalize)
+    return table
+
+
+def main():
+    symbols = [s for s in MY_SYMBOLS if os.path.exists(os.path.join('data', 'prices-by-date-{}.csv'.format(s)))]
+    feeds = load_feeds(symbols, datetime(2019, 1, 2), datetime(2020, 4, 9), adjusted=True)
+    panel = Panel(feeds)
+    print('Panel', len(panel.dates), 'days x', len(panel.symbols), 'symbols,', len(panel.methods), 'methods')
+    table = pd.concat([
+        portfolio_returns(panel, weighting=weighting, normalize=normalize)
+        for weighting in WEIGHTINGS for normalize in [True, False]
+    ]).sort_values('rtot', ascending=False)
+    table.to_csv(PORTFOLIO_FN, index=False)
+    print(table.head(20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+from dataset.util import share_arrays, attach_arrays, worker_pool, WORKER
+from dataset.config import MAX_PROCS, MY_SYMBOLS
+from datetime import datetime
+from backtest import (
+    load_signals, load_bars, align_signals, grid_targets, grid_keys, random_targets,
+    percentile_rank, simulate_targets, run_stats, START_CASH, THRESHS, MULTIPLIERS
+)
+import pandas as pd
+import numpy as np
+import zlib
+import os
+
+
+RETURNS_SWEEP_FN = os.path.join('data', 'returns-sweep.csv')
+BAR_COLS = ['open', 'high', 'low', 'close', 'volume']
+RAND_SEED = 1337
+
+def load_feeds(symbols, start, end, adjusted=True, missing='zero', folder='data'):
+    # {symbol: (bars, methods, signals)}, each symbol's csvs are read once
+    feeds = {}
+    for symbol in symbols:
+        rs_df, methods = load_signals(symbol, adjusted=adjusted, folder=folder)
+        bars = load_bars(symbol, start, end, folder=folder)
+        feeds[symbol] = (bars, methods, align_signals(rs_df, methods, bars['date'].tolist(), missing=missing))
+    return feeds
+
+
+def _setup_worker(specs, methods, grid):
+    shms, arrays = attach_arrays(specs)
+    return {'shms': shms, 'arrays': arrays, 'methods': methods, 'grid': grid}
+
+
+def _run_task(task):
+    symbol, kind, lo, hi = task
+    threshs, multipliers, cash = WORKER['grid']
+    prices = WORKER['arrays'][symbol + '/prices']
+    opens, closes = prices[:, BAR_COLS.index('open')], prices[:, BAR_COLS.index('close')]
+    draws = [np.nan]
+    if kind == 'grid':
+        methods = WORKER['methods'][symbol][lo:hi]
+        signals = WORKER['arrays'][symbol + '/signals'][:, lo:hi]
+        targets = grid_targets(signals, threshs=threshs, multipliers=multipliers)
+        keys = grid_keys(methods, threshs=threshs, multipliers=multipliers)
+    elif kind == 'rand':
+        # seeded by symbol and chunk so a symbol gets the same paths whatever
+        # the pool size or the other symbols in the sweep
+        seed = [RAND_SEED, zlib.crc32(symbol.encode('utf-8')), lo]
+        targets = random_targets(len(prices), hi - lo, seed=seed)
+        keys = [('rand', np.nan, np.nan)] * (hi - lo)
+        draws = range(lo, hi)
+    else:
+        targets = np.ones((len(prices), 1), dtype=bool)
+        keys = [('long', np.nan, np.nan)]
+    _, values = simulate_targets(opens, closes, targets, cash=cash)
+    stats = run_stats(values, targets, cash=cash)
+    rows = []
+    for i, (method, thresh, multi) in enumerate(keys):
+        row = {'symbol': symbol, 'method': method, 'thresh': thresh, 'multiplier': multi,
+            'draw': draws[i] if kind == 'rand' else np.nan}
+        row.update({stat: vals[i] for stat, vals in stats.items()})
+        rows.append(row)
+    return rows
+
+
+def _make_tasks(methods, n_rand, chunk_size, rand_chunk_size):
+    tasks = []
+    for symbol, sym_methods in methods.items():
+        for lo in range(0, len(sym_methods), chunk_size):
+            tasks.append((symbol, 'grid', lo, min(lo + chunk_size, len(sym_methods))))
+        tasks.append((symbol, 'long', 0, 1))
+        for lo in range(0, n_rand, rand_chunk_size):
+            tasks.append((symbol, 'rand', lo, min(lo + rand_chunk_size, n_rand)))
+    return tasks
+
+
+def sweep_returns(feeds, adjusted=True, threshs=THRESHS, multipliers=MULTIPLIERS, n_rand=5000,
+        cash=START_CASH, procs=MAX_PROCS, chunk_size=64, rand_chunk_size=1000, fn=RETURNS_SWEEP_FN):
+
+    # feeds from load_feeds, the bars and signals are put in shared memory
+    # once and the workers split the grid, the long baseline and n_rand
+    # random long/flat paths between them. rand_pct is where each run's rtot
+    # falls in its symbol's random distribution
+    arrays = {}
+    methods = {}
+    for symbol, (bars, sym_methods, signals) in feeds.items():
+        methods[symbol] = sym_methods
+        arrays[symbol + '/prices'] = bars[BAR_COLS].to_numpy(dtype=np.float64)
+        arrays[symbol + '/signals'] = np.ascontiguousarray(signals, dtype=np.float64)
+    grid = (threshs, multipliers, cash)
+    tasks = _make_tasks(methods, n_rand, chunk_size, rand_chunk_size)
+    print('Sweeping', len(feeds), 'symbols in', len(tasks), 'tasks')
+
+    rows = []
+    if procs > 1 and len(tasks) > 1:
+        shms, specs = share_arrays(arrays)
+        with worker_pool(min(procs, len(tasks)), _setup_worker, (specs, methods, grid), spawn=True, shms=shms) as pool:
+            for task_rows in pool.imap_unordered(_run_task, tasks):
+                rows.extend(task_rows)
+    else:
+        WORKER.update({'shms': {}, 'arrays': arrays, 'methods': methods, 'grid': grid})
+        for task in tasks:
+            rows.extend(_run_task(task))
+
+    table = pd.DataFrame(rows).sort_values(['symbol', 'method', 'thresh', 'multiplier', 'draw'])
+    table['rand_pct'] = np.nan
+    for symbol, sym_table in table.groupby('symbol'):
+        dist = sym_table.loc[sym_table['method'] == 'rand', 'rtot']
+        runs = sym_table.index[sym_table['method'] != 'rand']
+        if len(dist) > 0:
+            table.loc[runs, 'rand_pct'] = percentile_rank(dist, table.loc[runs, 'rtot'])
+    table.insert(1, 'adjusted', adjusted)
+    if fn is not None:
+        table.to_csv(fn, index=False)
+    return table.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    feeds = load_feeds(MY_SYMBOLS, datetime(2019, 1, 2), datetime(2020, 4, 9), adjusted=True)
+    print(sweep_returns(feeds, adjusted=True).groupby(['symbol', 'method'])['rtot'].max())
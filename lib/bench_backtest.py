@@ -0,0 +1,105 @@
+from analyze_returns import _simulate_return, RSStrat, LongStrat, RandomStrat
+from backtest import (
+    load_signals, load_bars, align_signals, backtest_grid, simulate_targets, grid_keys,
+    random_targets, percentile_rank
+)
+from datetime import datetime
+import pandas as pd
+import numpy as np
+import tempfile
+import time
+import os
+
+
+PRICE_COLS = [
+    'low', 'close', 'volume', 'lg_close', 'lg_open', 'lg_yopen_to_yclose', 'lg_topen_to_tclose',
+    'lg_tmopen_to_tmclose', 'lg_yclose_tclose', 'lg_tclose_tmclose', 'open', 'high'
+]
+
+
+def make_fixture(folder, sym='FIXT', n_days=250, n_methods=4, seed=1337):
+
+    # random walk with big overnight gaps so some buys get rejected for
+    # margin, plus nan signals and days missing from the signal csv
+    rand = np.random.RandomState(seed)
+    dates = pd.bdate_range('2019-01-01', periods=n_days).strftime('%Y-%m-%d')
+    closes = 50 * np.exp(np.cumsum(rand.normal(0, 0.02, n_days)))
+    opens = np.concatenate([[50], closes[:-1]]) * np.exp(rand.normal(0, 0.02, n_days))
+    prices = pd.DataFrame({
+        'date': dates,
+        'open': opens.round(2),
+        'high': np.maximum(opens, closes).round(2) + 0.5,
+        'low': np.minimum(opens, closes).round(2) - 0.5,
+        'close': closes.round(2),
+        'volume': rand.randint(1000, 10000, n_days)
+    })
+    prices.to_csv(os.path.join(folder, 'PRICE_{}.csv'.format(sym)), index=False)
+
+    rs_df = pd.DataFrame({'date': dates})
+    for i in range(n_methods):
+        signal = rand.normal(0, 0.1, n_days)
+        signal[rand.rand(n_days) < 0.05] = np.nan
+        rs_df['method{}'.format(i)] = signal
+    for col in PRICE_COLS:
+        rs_df[col] = 0
+    rs_df = rs_df[rand.rand(n_days) > 0.05]
+    rs_df.to_csv(os.path.join(folder, 'prices-by-date-{}.csv'.format(sym)))
+    return sym, datetime.strptime(dates[10], '%Y-%m-%d'), datetime.strptime(dates[-10], '%Y-%m-%d')
+
+
+def verify(sym, start, end, folder='data', missing='zero'):
+
+    rs_df, methods = load_signals(sym, folder=folder)
+    bars = load_bars(sym, start, end, folder=folder)
+
+    start_time = time.time()
+    signals = align_signals(rs_df, methods, bars['date'].tolist(), missing=missing)
+    expected = {}
+    for method, thresh, multi in grid_keys(methods):
+        expected[(method, thresh, multi)] = _simulate_return(sym, RSStrat, bars,
+            rs=signals[:, methods.index(method)], method=method, multiplier=multi, thresh=thresh)
+    bt_secs = time.time() - start_time
+
+    start_time = time.time()
+    data = backtest_grid(bars, rs_df, methods, missing=missing)
+    np_secs = time.time() - start_time
+
+    diffs = np.array([abs(data[key] - expected[key]) for key in expected])
+    long_rtot = simulate_targets(bars['open'], bars['close'], np.ones((len(bars), 1)))[0][0]
+    long_diff = abs(long_rtot - _simulate_return(sym, LongStrat, bars))
+    print('{} missing={}: {} runs, max |rtot diff|={:.2e}, long |rtot diff|={:.2e}'.format(
+        sym, missing, len(expected), diffs.max(), long_diff))
+    print('backtrader {:.2f}s numpy {:.4f}s ({:.0f}x)'.format(bt_secs, np_secs, bt_secs / np_secs))
+    return diffs.max()
+
+
+def verify_random(sym, start, end, folder='data', n_runs=20, n_draws=5000):
+
+    # the old baseline, n_runs backtrader RandomStrat runs, should look like
+    # draws from the vectorized distribution
+    bars = load_bars(sym, start, end, folder=folder)
+
+    start_time = time.time()
+    bt_rtot = np.array([_simulate_return(sym, RandomStrat, bars) for _ in range(n_runs)])
+    bt_secs = time.time() - start_time
+
+    start_time = time.time()
+    rtot, _ = simulate_targets(bars['open'], bars['close'], random_targets(len(bars), n_draws, seed=0))
+    np_secs = time.time() - start_time
+
+    print('{} RandomStrat median rtot={:.4f}, {} paths median={:.4f}, RandomStrat percentile ranks {:.0f}-{:.0f}'.format(
+        sym, np.median(bt_rtot), n_draws, np.median(rtot), *percentile_rank(rtot, [bt_rtot.min(), bt_rtot.max()])))
+    print('backtrader {} runs {:.2f}s numpy {} paths {:.4f}s'.format(n_runs, bt_secs, n_draws, np_secs))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        for seed in range(3):
+            sym, start, end = make_fixture(folder, sym='FIXT{}'.format(seed), seed=seed)
+            for missing in ['zero', 'nan', 'ffill']:
+                verify(sym, start, end, folder=folder, missing=missing)
+            verify_random(sym, start, end, folder=folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+from embs.articles import load_embs_from_exp_id
+from embs.index import IVFIndex
+import numpy as np
+import time
+import glob
+import os
+
+
+ART_EXP_IDS = [
+    os.path.splitext(os.path.basename(fn))[0]
+    for fn in glob.iglob(os.path.join('data', 'article-embs-*-*-*.npy'))
+]
+
+
+def bench_index(embs, k=10, n_queries=500, n_probes=(1, 4, 8, 16, 32)):
+
+    rand = np.random.RandomState(1337)
+    queries = embs[rand.choice(len(embs), min(n_queries, len(embs)), replace=False)]
+
+    start = time.time()
+    index = IVFIndex().build(embs)
+    print('Built {} lists over {} vectors in {:.2f}s'.format(index.n_lists, len(embs), time.time() - start))
+
+    start = time.time()
+    exact_ids, _ = index.exact_query(queries, k=k)
+    exact_ms = (time.time() - start) / len(queries) * 1000
+    print('exact        {:.3f} ms/query'.format(exact_ms))
+
+    for n_probe in n_probes:
+        start = time.time()
+        ids, _ = index.query(queries, k=k, n_probe=n_probe)
+        ms = (time.time() - start) / len(queries) * 1000
+        recall = np.mean([len(np.intersect1d(a, b)) / len(a) for a, b in zip(exact_ids, ids)])
+        print('n_probe={:<4d} {:.3f} ms/query recall@{}={:.4f}'.format(n_probe, ms, k, recall))
+
+
+def main():
+    for exp_id in ART_EXP_IDS:
+        print(exp_id)
+        bench_index(load_embs_from_exp_id(exp_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from dataset.util import sql_read_articles
+from sentiment.articles import VADERSentiment, VADERFastSentiment, AllenNLPGlove
+from sentiment.client import ConcurrentScorer, text_key
+import multiprocessing as mp
+import numpy as np
+import threading
+import resource
+import tempfile
+import random
+import time
+import os
+
+
+def bench_vader(docs, name, n_sample=2000):
+
+    sample = random.Random(1337).sample(docs, min(n_sample, len(docs)))
+
+    slow = VADERSentiment(name, sample)
+    slow.prep()
+    start = time.time()
+    slow.bake_sentiment()
+    slow_rate = len(sample) / (time.time() - start)
+
+    fast = VADERFastSentiment(name, sample)
+    fast.prep()
+    start = time.time()
+    fast.bake_sentiment()
+    fast_rate = len(sample) / (time.time() - start)
+
+    diff = np.abs(slow.doc_sent - fast.doc_sent)
+    print(name)
+    print('vader     {:.1f} docs/sec'.format(slow_rate))
+    print('vaderfast {:.1f} docs/sec ({:.1f}x)'.format(fast_rate, fast_rate / slow_rate))
+    print('corr={:.6f} mean_abs_diff={:.6f} max_abs_diff={:.6f} exact={:.4f} sign_agree={:.4f}'.format(
+        np.corrcoef(slow.doc_sent, fast.doc_sent)[0, 1], diff.mean(), diff.max(),
+        np.mean(diff == 0), np.mean(np.sign(slow.doc_sent) == np.sign(fast.doc_sent))))
+
+
+def _bake_allenglove(docs, batch_size, model_path):
+    test = AllenNLPGlove('bench', docs, batch_size=batch_size, model_path=model_path)
+    test.prep()
+    # ru_maxrss is in kB on linux and only ever goes up, hence a fresh process per run
+    load_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.time()
+    test.bake_sentiment()
+    rate = len(docs) / (time.time() - start)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return test.doc_sent, rate, load_mb, peak_mb
+
+
+def bench_allenglove(docs, name, batch_sizes=(1, 16, 64, 256), n_sample=2000, model_path=None):
+
+    sample = random.Random(1337).sample(docs, min(n_sample, len(docs)))
+    ctx = mp.get_context('spawn')
+
+    print(name)
+    base = None
+    for batch_size in batch_sizes:
+        with ctx.Pool(1) as pool:
+            sent, rate, load_mb, peak_mb = pool.apply(_bake_allenglove, (sample, batch_size, model_path))
+        if base is None:
+            base = sent
+        print('batch_size={:<4d} {:.1f} docs/sec peak={:.0f}MB (model {:.0f}MB) max_abs_diff={:.6f}'.format(
+            batch_size, rate, peak_mb, load_mb, np.abs(sent - base).max()))
+
+
+class StandInService:
+
+    # local stand-in for analyze_sentiment, fixed latency, a qps quota that
+    # rejects anything over it and random transient errors
+    def __init__(self, qps=10, latency=0.1, error_rate=0.05, seed=1337):
+        self.qps = qps
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = []
+        self.rejected = 0
+
+    def expected(self, doc):
+        return int(text_key(doc)[:8], 16) / 0xffffffff * 2 - 1
+
+    def analyze(self, doc):
+        with self.lock:
+            now = time.monotonic()
+            self.recent = [t for t in self.recent if now - t < 1] + [now]
+            if len(self.recent) > self.qps + 1:
+                self.rejected += 1
+                raise ConnectionError('quota exceeded')
+            failed = self.rand.random() < self.error_rate
+        time.sleep(self.latency)
+        if failed:
+            raise ConnectionError('stand-in transient error')
+        return self.expected(doc)
+
+
+def bench_gcp_client(docs, n_sample=300, qps=10, max_in_flight=8):
+
+    sample = random.Random(1337).sample(docs, min(n_sample, len(docs)))
+    service = StandInService(qps=qps)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in ['cold', 'cached']:
+            client = ConcurrentScorer(service.analyze, rate=qps, max_in_flight=max_in_flight,
+                backoff=0.1, cache_fn=os.path.join(tmp, 'cache.sqlite'))
+            start = time.time()
+            scores = client.score(sample)
+            rate = len(sample) / (time.time() - start)
+            wrong = np.sum(np.abs(scores - [service.expected(doc) for doc in sample]) > 1e-9)
+            print('{:<6s} {:.1f} docs/sec {} rejected by quota={} wrong={}'.format(
+                run, rate, client.stats, service.rejected, wrong))
+    print('one at a time with sleep(0.2) ~{:.1f} docs/sec'.format(1 / (service.latency + 0.2)))
+
+
+def main():
+    articles = sql_read_articles(only_labeled=True)
+    headlines = [a[2] for a in articles]
+    content = [a[2] + '\n\n' + a[4] for a in articles]
+    bench_vader(headlines, 'headlines')
+    bench_vader(content, 'content')
+    bench_allenglove(headlines, 'headlines')
+    bench_allenglove(content, 'content')
+    bench_gcp_client(headlines)
+
+
+if __name__ == "__main__":
+    main()
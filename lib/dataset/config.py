@@ -1,10 +1,22 @@
 import random
+import os
 
 
 RANDOM = random.Random(1337)
 
 DATABASE_URI = 'db.sqlite'
 
+
+def _env_flag(name):
+    # 1, true or yes turn a flag on, anything else (including 0) leaves it off
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'yes')
+
+
+HEADLESS = _env_flag('HEADLESS')
+
+# bake VADER with the batched LexiconScorer (VADERFastSentiment)
+FAST_VADER = _env_flag('FAST_VADER')
+
 MAX_PROCS = 8
 
 MY_SYMBOLS = [
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+class Grouping:
+
+    def __init__(self, keys, rows=None):
+        keys = np.asarray(keys)
+        if rows is None:
+            rows = np.arange(len(keys))
+        self.keys, self.codes = np.unique(keys, return_inverse=True)
+        # CSR layout, members of group i are rows[offsets[i]:offsets[i + 1]]
+        self.rows = np.asarray(rows)[np.argsort(self.codes, kind='stable')]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(self.codes, minlength=len(self.keys)))])
+        self.key_to_group = {key: i for i, key in enumerate(self.keys.tolist())}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys.tolist())
+
+    def __contains__(self, key):
+        return key in self.key_to_group
+
+    def __getitem__(self, key):
+        group = self.key_to_group.get(key)
+        if group is None:
+            return self.rows[:0]
+        return self.rows[self.offsets[group]:self.offsets[group + 1]]
+
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def compact(self):
+        # the same groups over 0..len(rows) - 1, for arrays already gathered
+        # with self.rows
+        return Grouping(np.repeat(self.keys, self.sizes()))
+
+    def subset(self, rows):
+        rows = np.asarray(rows)
+        return Grouping(self.keys[self.codes[rows]], rows=rows)
+
+
+class CorpusIndex:
+
+    def __init__(self, articles):
+        self.size = len(articles)
+        self.symbols = Grouping([a[1] for a in articles])
+        self.dates = Grouping([a[3] for a in articles])
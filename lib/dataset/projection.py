@@ -0,0 +1,73 @@
+import numpy as np
+import hashlib
+import pickle
+import umap
+import os
+
+
+CACHE_DIR = os.path.join('data', 'umap-cache')
+
+
+def embs_hash(embs):
+    embs = np.ascontiguousarray(embs)
+    sha = hashlib.sha1(str((embs.shape, embs.dtype.str)).encode())
+    sha.update(embs.tobytes())
+    return sha.hexdigest()
+
+
+def labels_hash(labels):
+    # the sample depends on the labels, so they are part of the cache key
+    if labels is None:
+        return 'none'
+    sha = hashlib.sha1()
+    for label in labels:
+        sha.update(str(label).encode('utf-8') + b'\0')
+    return sha.hexdigest()[:12]
+
+
+def stratified_sample(labels, size, seed=1337):
+    rand = np.random.RandomState(seed)
+    labels = np.asarray(labels)
+    if size >= len(labels):
+        return np.arange(len(labels))
+    _, inv, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    # proportional share per label but keep rare labels represented
+    quotas = np.maximum(1, np.round(counts / len(labels) * size)).astype(int)
+    idxs = []
+    for label_idx, quota in enumerate(quotas):
+        members = np.flatnonzero(inv == label_idx)
+        idxs.append(rand.choice(members, min(quota, len(members)), replace=False))
+    return np.sort(np.concatenate(idxs))
+
+
+def project_embs(embs, labels=None, sample_size=10000, key=None, cache_dir=CACHE_DIR):
+
+    if key is None:
+        key = embs_hash(embs)
+    key = '{}-{}-{}'.format(key, sample_size, labels_hash(labels))
+    fn_reducer = os.path.join(cache_dir, key + '.pkl')
+    fn_rembs = os.path.join(cache_dir, key + '.npy')
+    if os.path.exists(fn_reducer) and os.path.exists(fn_rembs):
+        with open(fn_reducer, 'rb') as f:
+            reducer = pickle.load(f)
+        return reducer, np.load(fn_rembs)
+
+    reducer = umap.UMAP()
+    if len(embs) <= sample_size:
+        rembs = reducer.fit_transform(embs)
+    else:
+        if labels is None:
+            labels = np.zeros(len(embs))
+        sample_idxs = stratified_sample(labels, sample_size)
+        reducer.fit(embs[sample_idxs])
+        rest = np.ones(len(embs), dtype=bool)
+        rest[sample_idxs] = False
+        rembs = np.empty((len(embs), 2), dtype=np.float32)
+        rembs[sample_idxs] = reducer.embedding_
+        rembs[rest] = reducer.transform(embs[rest])
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(fn_reducer, 'wb') as f:
+        pickle.dump(reducer, f)
+    np.save(fn_rembs, rembs)
+    return reducer, rembs
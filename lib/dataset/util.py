@@ -1,15 +1,18 @@
-from multiprocessing import Pool
+from multiprocessing import get_context, shared_memory
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
+import hashlib
 import random
 import sqlite3
 import signal
 import glob
-import umap
+import json
 import re
 import os
 
 from .config import DATABASE_URI, MAX_PROCS
+from .projection import project_embs
 
 
 IGNORE_TEXT = [
@@ -161,28 +164,110 @@ def download_prices(symb, key='KOZNM03XM806URDU', refresh=False):
     return df
 
 
-def reduce_embs(embs):
-    reducer = umap.UMAP()
-    rembs = reducer.fit_transform(embs)
-    return reducer, rembs
+def dedup_texts(texts):
+    # unique texts plus, for every row, the index of its unique text
+    seen = {}
+    uniques = []
+    inverse = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        key = hashlib.sha1(text.encode('utf-8')).digest()
+        idx = seen.get(key)
+        if idx is None:
+            idx = seen[key] = len(uniques)
+            uniques.append(text)
+        inverse[i] = idx
+    return uniques, inverse
 
 
-def _init_worker():
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+def print_dedup_report(name, texts, uniques):
+    saved = 1 - len(uniques) / max(len(texts), 1)
+    print('{}: {} rows, {} unique, dedup ratio {:.2f}x, {:.1%} of compute saved'.format(
+        name, len(texts), len(uniques), len(texts) / max(len(uniques), 1), saved))
+
+
+def reduce_embs(embs, labels=None):
+    return project_embs(embs, labels=labels)
+
+
+# per-process state of a worker_pool worker, filled by its setup function
+WORKER = {}
 
 
-def run_multi(func, params, shuffle=False):
+def _init_pool_worker(setup, args):
+    # Ctrl-C is handled once, in the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if setup is not None:
+        WORKER.update(setup(*args))
+
+
+@contextmanager
+def worker_pool(procs, setup=None, args=(), spawn=False, shms=(), env=None):
+    # a Pool whose workers ignore Ctrl-C and hold setup(*args) in WORKER.
+    # it is closed and joined when the block finishes, on any error or
+    # Ctrl-C it is terminated and the error re-raised. shms (from
+    # share_arrays) are closed and unlinked either way. env vars are only
+    # set while the workers start, the parent's are put back after
+    ctx = get_context('spawn' if spawn else None)
+    saved = {var: os.environ.get(var) for var in (env or {})}
+    try:
+        try:
+            os.environ.update(env or {})
+            pool = ctx.Pool(procs, initializer=_init_pool_worker, initargs=(setup, args))
+        finally:
+            for var, val in saved.items():
+                if val is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = val
+        try:
+            yield pool
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+def run_multi(func, params, shuffle=False, procs=MAX_PROCS):
+    # Ctrl-C stops the pool and returns so the caller can keep what finished
     params = list(params)
-    random.shuffle(params)
-    pool = Pool(MAX_PROCS, initializer=_init_worker)
+    if shuffle:
+        random.shuffle(params)
     try:
-        pool.starmap(func, params)
+        with worker_pool(procs) as pool:
+            pool.starmap(func, params)
     except KeyboardInterrupt:
-        pool.terminate()
-        pool.join()
         print('Interrupted!')
 
 
+def share_arrays(arrays):
+    # copies each array into shared memory, the specs are picklable for
+    # attach_arrays in a worker, the caller closes and unlinks the shms
+    shms = []
+    specs = {}
+    for key, arr in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        shms.append(shm)
+        specs[key] = (shm.name, arr.shape, arr.dtype.str)
+    return shms, specs
+
+
+def attach_arrays(specs):
+    shms = {}
+    arrays = {}
+    for key, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        shms[key] = shm
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return shms, arrays
+
+
 def sql_attempt(conn, cur, sql):
     try:
         cur.execute(sql)
@@ -221,6 +306,19 @@ def sql_connect(group=''):
         sector VARCHAR(255),
         desc TEXT
     )""")
+    sql_attempt(conn, cur, """
+    CREATE TABLE models (
+        model_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        exp_id VARCHAR(255) UNIQUE,
+        tag VARCHAR(20),
+        art_exp_id VARCHAR(255),
+        params TEXT,
+        epoch INTEGER,
+        val_accuracy REAL,
+        path VARCHAR(255),
+        embs_path VARCHAR(255),
+        art_embs_path VARCHAR(255)
+    )""")
     if sql_attempt(conn, cur, "ALTER TABLE articles ADD source VARCHAR(20)"):
         cur.execute("UPDATE articles SET source=?", ('marketwatch',))
         conn.commit()
@@ -247,6 +345,16 @@ def sql_add_company(cur, params):
     """, params)
 
 
+def sql_add_model(cur, params):
+    assert len(params) == 9, 'Bad Model'
+    cur.execute("""
+    INSERT OR REPLACE INTO models
+        (exp_id, tag, art_exp_id, params, epoch, val_accuracy, path, embs_path, art_embs_path)
+        VALUES
+        (?,?,?,?,?,?,?,?,?)
+    """, params)
+
+
 def sql_merge(groups=None, delete=False):
     if groups is None:
         groups = [os.path.splitext(os.path.basename(fn))[0].replace('db-', '') 
@@ -277,6 +385,83 @@ def sql_read_articles(only_labeled=False):
     return articles
 
 
+def sql_read_article_dates(only_labeled=False, since=None):
+    # (positions, dates) of the articles dated since or later, positions
+    # index the sql_read_articles(only_labeled) order, and that list's length
+    (conn, cur) = sql_connect()
+    where = ' WHERE symbol != \'????\'' if only_labeled else ''
+    total = cur.execute('SELECT COUNT(*) FROM articles' + where).fetchone()[0]
+    cmd = 'SELECT pos, date FROM (SELECT ROW_NUMBER() OVER (ORDER BY article_id ASC) - 1 AS pos, date FROM articles' + where + ')'
+    args = ()
+    if since is not None:
+        cmd += ' WHERE date >= ?'
+        args = (since,)
+    rows = cur.execute(cmd + ' ORDER BY pos ASC', args).fetchall()
+    conn.close()
+    positions = np.array([r[0] for r in rows], dtype=np.int64)
+    return positions, [r[1] for r in rows], total
+
+
+def sql_read_models(tag=None):
+    (conn, cur) = sql_connect()
+    cmd = 'SELECT exp_id, tag, art_exp_id, params, epoch, val_accuracy, path, embs_path, art_embs_path FROM models'
+    args = ()
+    if tag is not None:
+        cmd += ' WHERE tag = ?'
+        args = (tag,)
+    cmd += ' ORDER BY model_id ASC'
+    cols = ['exp_id', 'tag', 'art_exp_id', 'params', 'epoch', 'val_accuracy', 'path', 'embs_path', 'art_embs_path']
+    models = [dict(zip(cols, row)) for row in cur.execute(cmd, args).fetchall()]
+    conn.close()
+    for model in models:
+        model['params'] = json.loads(model['params'])
+    return models
+
+
+def sql_find_models(substring='', tag='keras'):
+    # registry rows whose exp_id contains substring, never empty
+    models = [m for m in sql_read_models(tag=tag) if substring in m['exp_id']]
+    if len(models) == 0:
+        raise Exception('No {} model matching "{}" in the models table, train one or run '
+            'register_legacy_models() for .h5 files saved before the table existed.'.format(tag, substring))
+    return models
+
+
+def sql_find_model(substring, tag='keras'):
+    models = sql_find_models(substring, tag=tag)
+    if len(models) > 1:
+        raise Exception('"{}" matches {} {} models: {}'.format(
+            substring, len(models), tag, ', '.join(m['exp_id'] for m in models)))
+    return models[0]
+
+
+def register_legacy_models(folder='data'):
+    # .h5 models trained before the models table, their filenames were the
+    # only record: company-embs-<n>-<art_exp_id>-keras-<latent_size>-
+    # <post_emb_layers>-<epoch>-<val_accuracy>.h5. already registered
+    # exp_ids are left alone so this can run any number of times
+    (conn, cur) = sql_connect()
+    known = set(row[0] for row in cur.execute('SELECT exp_id FROM models'))
+    added = []
+    for fn in sorted(glob.glob(os.path.join(folder, 'company-embs-*-article-embs-*-*-*-keras-*-*-*-*.h5'))):
+        parts = os.path.splitext(os.path.basename(fn))[0].split('-')
+        exp_id = '-'.join(parts[:-2])
+        if exp_id in known:
+            continue
+        art_exp_id = '-'.join(parts[3:-5])
+        params = {'latent_size': int(parts[-4]), 'post_emb_layers': int(parts[-3])}
+        sql_add_model(cur, (
+            exp_id, parts[-5], art_exp_id, json.dumps(params), int(parts[-2]), float(parts[-1]), fn,
+            os.path.join(folder, exp_id + '.npy'), os.path.join(folder, art_exp_id + '.npy')
+        ))
+        known.add(exp_id)
+        added.append(exp_id)
+    conn.commit()
+    conn.close()
+    print('Registered', len(added), 'legacy models')
+    return added
+
+
 def sql_read_companies_dict():
     (conn, cur) = sql_connect()
     companies = cur.execute('SELECT company_id, symbol, name, industry, sector, desc FROM companies ORDER BY company_id ASC').fetchall()
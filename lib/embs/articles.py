@@ -1,11 +1,12 @@
 from gensim.models.doc2vec import Doc2Vec as Doc2VecModel, TaggedDocument
 from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
 from bert_serving.client import BertClient
+from dataset.projection import project_embs
+from dataset.config import HEADLESS
 import plotly.express as px
 import pandas as pd
 import numpy as np
 import pickle
-import umap
 import nltk
 import os
 
@@ -22,6 +23,8 @@ class AbstractEmb:
     def __init__(self, name, docs, ds_name=None):
         if ds_name is None:
             ds_name = str(len(docs))
+        self.name = name
+        self.ds_name = ds_name
         self.docs = docs
         self.exp_id = 'article-embs-{}-{}-{}'.format(ds_name, self.TAG, name)
         self.exp_name = 'Article Embeddings ({} on {})'.format(self.TAG, name)
@@ -34,17 +37,30 @@ class AbstractEmb:
     def bake_embs(self):
         raise NotImplementedError()
 
+    def embed_more(self, docs, folder='data'):
+        # embeddings for docs added after the bake, in the same space. right
+        # for models that are not fit to the corpus, the others override it
+        self.docs = docs
+        self.prep()
+        self.bake_embs()
+        return self.doc_embs
+
+    def expand(self, docs, inverse):
+        # scatter embeddings baked on unique docs back to every row
+        self.docs = docs
+        self.doc_embs = self.doc_embs[inverse]
+
     def plot(self, label_name, labels):
         assert len(labels) == len(self.docs)
-        reducer = umap.UMAP()
-        docs_rembs = reducer.fit_transform(self.doc_embs)
+        _, docs_rembs = project_embs(self.doc_embs, labels=labels)
         df = pd.DataFrame({
             'x': docs_rembs[:, 0], 'y': docs_rembs[:, 1],
             label_name: labels,
             'doc': [d[:50] for d in self.docs]
         })
         self.figs[label_name] = px.scatter(df, x="x", y="y", color=label_name, hover_data=['doc'], title=self.exp_name)
-        self.figs[label_name].show()
+        if not HEADLESS:
+            self.figs[label_name].show()
 
     def save_all(self, folder='data'):
         fn_docs = os.path.join(folder, '{}.npy'.format(self.exp_id))
@@ -97,6 +113,10 @@ class Doc2Vec(AbstractEmb):
         model.delete_temporary_training_data(keep_doctags_vectors=False, keep_inference=False)
         self.pickles.extend([model])
 
+    def embed_more(self, docs, folder='data'):
+        raise NotImplementedError('the saved doc2vec model has no inference data, '
+            'rerun gen_article_embs.py and retrain the company models on it')
+
 
 class CountVec(AbstractEmb):
 
@@ -111,6 +131,12 @@ class CountVec(AbstractEmb):
         self.doc_embs = (doc_freqs - mean) / std
         self.pickles.extend([count_model, freq_model, mean, std])
 
+    def embed_more(self, docs, folder='data'):
+        with open(os.path.join(folder, '{}.pkl'.format(self.exp_id)), 'rb') as pkl_file:
+            count_model, freq_model, mean, std = pickle.load(pkl_file)
+        doc_freqs = freq_model.transform(count_model.transform(docs)).toarray()
+        return (doc_freqs - mean) / std
+
 
 EMBEDDINGS = [
     PretrainedBERT,
@@ -1,20 +1,84 @@
 from keras.layers import Input, Embedding, Dense, Dot, Reshape
-from keras.callbacks import ModelCheckpoint, EarlyStopping
-from keras.models import Model, load_model
+from keras.callbacks import Callback, EarlyStopping
+from keras.models import Model
+from keras.utils import Sequence
+from dataset.projection import project_embs
+from dataset.util import sql_connect, sql_add_model
+from dataset.config import HEADLESS
+from embs.relevance import RelevanceScorer, export_relevance, scorer_fn, check_scorer
 import plotly.express as px
 import pandas as pd
 import numpy as np
 import random
-import umap
-import glob
+import json
 import os
 
 
+def sample_negatives(sym_idxs, n_arts, pos_keys, rand):
+    # one article per row that is not a positive for that row's symbol
+    art_idxs = rand.randint(0, n_arts, len(sym_idxs))
+    bad = np.isin(sym_idxs * n_arts + art_idxs, pos_keys)
+    while bad.any():
+        art_idxs[bad] = rand.randint(0, n_arts, bad.sum())
+        bad[bad] = np.isin(sym_idxs[bad] * n_arts + art_idxs[bad], pos_keys)
+    return art_idxs
+
+
+class PairSequence(Sequence):
+
+    def __init__(self, art_embs, sym_idxs, art_idxs, pos_keys, batch_size=16, resample=True, seed=1337):
+        self.art_embs = art_embs
+        self.pos_sym_idxs = sym_idxs
+        self.pos_art_idxs = art_idxs
+        self.pos_keys = pos_keys
+        self.batch_size = batch_size
+        self.resample = resample
+        self.rand = np.random.RandomState(seed)
+        self._draw()
+
+    def _draw(self):
+        n = len(self.pos_sym_idxs)
+        neg_art_idxs = sample_negatives(self.pos_sym_idxs, len(self.art_embs), self.pos_keys, self.rand)
+        order = self.rand.permutation(2 * n)
+        self.S = np.concatenate([self.pos_sym_idxs, self.pos_sym_idxs])[order]
+        self.A = np.concatenate([self.pos_art_idxs, neg_art_idxs])[order]
+        self.Y = np.concatenate([np.ones(n), np.zeros(n)])[order]
+
+    def __len__(self):
+        return int(np.ceil(len(self.S) / self.batch_size))
+
+    def __getitem__(self, i):
+        batch = slice(i * self.batch_size, (i + 1) * self.batch_size)
+        return [self.S[batch], self.art_embs[self.A[batch]]], self.Y[batch]
+
+    def on_epoch_end(self):
+        if self.resample:
+            self._draw()
+
+
+class BestWeights(Callback):
+
+    def __init__(self, monitor='val_accuracy'):
+        super().__init__()
+        self.monitor = monitor
+        self.best = -np.inf
+        self.best_epoch = None
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        val = (logs or {}).get(self.monitor)
+        if val is not None and val > self.best:
+            self.best = val
+            self.best_epoch = epoch + 1
+            self.best_weights = self.model.get_weights()
+
+
 class AbstractEmb:
 
     TAG = 'abs'
 
     def __init__(self, art_exp_id, art_embs, sym_to_idx, sym_to_art_idxs, **kwargs):
+        self.art_exp_id = art_exp_id
         self.art_embs = art_embs
         self.sym_to_idx = sym_to_idx
         self.sym_to_art_idxs = sym_to_art_idxs
@@ -34,15 +98,15 @@ class AbstractEmb:
 
     def plot(self, label_name, labels, names):
         assert len(labels) == len(self.sym_to_idx)
-        reducer = umap.UMAP()
-        comp_rembs = reducer.fit_transform(self.comp_embs)
+        _, comp_rembs = project_embs(self.comp_embs, labels=labels)
         df = pd.DataFrame({
             'x': comp_rembs[:, 0], 'y': comp_rembs[:, 1],
             label_name: labels,
             'name': names
         })
         self.figs[label_name] = px.scatter(df, x="x", y="y", color=label_name, hover_name='name', title=self.exp_name)
-        self.figs[label_name].show()
+        if not HEADLESS:
+            self.figs[label_name].show()
 
     def save_all(self, folder='data'):
         fn_embs = os.path.join(folder, '{}.npy'.format(self.exp_id))
@@ -51,7 +115,6 @@ class AbstractEmb:
             for name, fig in self.figs.items():
                 fn_fig = os.path.join(folder, '{}-{}.png'.format(self.exp_id, name.lower()))
                 fig.write_image(fn_fig)
-        # model already saved
 
 
 class KerasDeep(AbstractEmb):
@@ -88,29 +151,36 @@ class KerasDeep(AbstractEmb):
         return model
 
     def _train(self):
-        checkpoint = ModelCheckpoint(self.model_save_path, monitor='val_accuracy', verbose=1, save_best_only=True)
+        best_weights = BestWeights(monitor='val_accuracy')
         early_stop = EarlyStopping(monitor='val_accuracy', patience=4)
-        S, A, Y = self.dataset
-        hist = self.model.fit(x=[S, A], y=Y, epochs=20, batch_size=16, validation_split=0.3, 
-            callbacks=[checkpoint, early_stop])
+        S, A = self.dataset
+        order = np.random.RandomState(1337).permutation(len(S))
+        val_size = int(len(S) * 0.3)
+        val_idxs, train_idxs = order[:val_size], order[val_size:]
+        pos_keys = np.unique(S * len(self.art_embs) + A)
+        train_seq = PairSequence(self.art_embs, S[train_idxs], A[train_idxs], pos_keys)
+        # fixed negatives so val_accuracy is comparable across epochs
+        val_seq = PairSequence(self.art_embs, S[val_idxs], A[val_idxs], pos_keys, resample=False)
+        hist = self.model.fit_generator(train_seq, validation_data=val_seq, epochs=20,
+            callbacks=[best_weights, early_stop])
+        self.history = hist.history
+        self.model.set_weights(best_weights.best_weights)
+        self.best_epoch = best_weights.best_epoch
+        self.val_accuracy = float(best_weights.best)
 
     def prep(self):
         self.model = self._build_model()
-        self.model_save_path = os.path.join('data', self.exp_id + '-{epoch:02d}-{val_accuracy:.4f}.h5')
-        self.models_glob = os.path.join('data', self.exp_id + '-*.h5')
 
     def bake_embs(self):
 
         self._train()
-        del self.model
-
-        models = glob.glob(self.models_glob)
-        best_model = max(models, key=lambda path: float(path.split('-')[-1].replace('.h5', '')))
-        for model_fn in models:
-            if model_fn != best_model:
-                os.remove(model_fn)
+        self.model_path = os.path.join('data', '{}-{:02d}-{:.4f}.h5'.format(
+            self.exp_id, self.best_epoch, self.val_accuracy))
+        self.model.save(self.model_path)
+        export_relevance(self.model, scorer_fn(self.model_path))
+        scorer = RelevanceScorer.load(scorer_fn(self.model_path))
+        print('NumPy scorer max abs diff:', check_scorer(self.model, scorer, self.art_embs))
 
-        self.model = load_model(best_model)
         self.sym_emb_model = Model(
             inputs=self.model.get_layer('symbol').get_input_at(0), 
             outputs=self.model.get_layer('symbol_emb').get_output_at(0)
@@ -119,6 +189,18 @@ class KerasDeep(AbstractEmb):
         self.comp_embs = self.sym_emb_model.predict(
             np.array(list(self.sym_to_idx.values()))).squeeze()
 
+    def save_all(self, folder='data'):
+        super().save_all(folder=folder)
+        (conn, cur) = sql_connect()
+        sql_add_model(cur, (
+            self.exp_id, self.TAG, self.art_exp_id, json.dumps(self.args),
+            self.best_epoch, self.val_accuracy, self.model_path,
+            os.path.join(folder, '{}.npy'.format(self.exp_id)),
+            os.path.join('data', self.art_exp_id + '.npy')
+        ))
+        conn.commit()
+        conn.close()
+
 
 EMBEDDINGS = [
     KerasDeep
@@ -0,0 +1,140 @@
+import numpy as np
+import os
+
+
+def _normalize(vecs):
+    vecs = np.array(vecs, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vecs / norms
+
+
+def _nearest(vecs, cents, batch_size=65536):
+    assign = np.empty(len(vecs), dtype=np.int64)
+    for i in range(0, len(vecs), batch_size):
+        assign[i:i + batch_size] = np.argmax(vecs[i:i + batch_size] @ cents.T, axis=1)
+    return assign
+
+
+def _top_k(sims, k):
+    # sims is (queries x candidates), returns sorted column idxs
+    k = min(k, sims.shape[1])
+    part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    part_sims = np.take_along_axis(sims, part, axis=1)
+    order = np.argsort(-part_sims, axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _kmeans(vecs, n_lists, iters=10, seed=1337):
+    # spherical k-means, centroids stay on the unit sphere
+    rand = np.random.RandomState(seed)
+    cents = vecs[rand.choice(len(vecs), n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = _nearest(vecs, cents)
+        sums = np.zeros_like(cents)
+        np.add.at(sums, assign, vecs)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        sums[empty] = vecs[rand.choice(len(vecs), empty.sum())]
+        cents = _normalize(sums)
+    return cents
+
+
+class IVFIndex:
+
+    def __init__(self, n_lists=None, n_probe=8, max_train=50000):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.max_train = max_train
+
+    def build(self, vecs, ids=None):
+        vecs = _normalize(vecs)
+        if ids is None:
+            ids = np.arange(len(vecs))
+        if self.n_lists is None:
+            self.n_lists = max(1, int(np.sqrt(len(vecs))))
+        self.n_lists = min(self.n_lists, len(vecs))
+        train = vecs
+        if len(vecs) > self.max_train:
+            train = vecs[np.random.RandomState(1337).choice(len(vecs), self.max_train, replace=False)]
+        self.cents = _kmeans(train, self.n_lists)
+        self.vecs = vecs
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.assign = _nearest(vecs, self.cents)
+        self._make_lists()
+        return self
+
+    def _make_lists(self):
+        order = np.argsort(self.assign, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assign, minlength=self.n_lists))])
+        self.lists = [order[offsets[i]:offsets[i + 1]] for i in range(self.n_lists)]
+
+    def add(self, vecs, ids=None):
+        vecs = _normalize(vecs)
+        start = len(self.vecs)
+        if ids is None:
+            ids = np.arange(self.ids.max() + 1, self.ids.max() + 1 + len(vecs))
+        assign = _nearest(vecs, self.cents)
+        self.vecs = np.concatenate([self.vecs, vecs])
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.assign = np.concatenate([self.assign, assign])
+        rows = np.arange(start, start + len(vecs))
+        for list_idx in np.unique(assign):
+            self.lists[list_idx] = np.concatenate([self.lists[list_idx], rows[assign == list_idx]])
+
+    def query(self, vecs, k=10, n_probe=None):
+        if n_probe is None:
+            n_probe = self.n_probe
+        vecs = _normalize(vecs)
+        probes = _top_k(vecs @ self.cents.T, n_probe)
+        res_ids = np.full((len(vecs), k), -1, dtype=np.int64)
+        res_sims = np.full((len(vecs), k), -np.inf, dtype=np.float32)
+        for i, vec in enumerate(vecs):
+            cands = np.concatenate([self.lists[p] for p in probes[i]])
+            if len(cands) == 0:
+                continue
+            sims = self.vecs[cands] @ vec
+            top = _top_k(sims[None], k)[0]
+            res_ids[i, :len(top)] = self.ids[cands[top]]
+            res_sims[i, :len(top)] = sims[top]
+        return res_ids, res_sims
+
+    def exact_query(self, vecs, k=10, batch_size=1024):
+        vecs = _normalize(vecs)
+        k = min(k, len(self.vecs))
+        res_ids = np.empty((len(vecs), k), dtype=np.int64)
+        res_sims = np.empty((len(vecs), k), dtype=np.float32)
+        for i in range(0, len(vecs), batch_size):
+            sims = vecs[i:i + batch_size] @ self.vecs.T
+            top = _top_k(sims, k)
+            res_ids[i:i + batch_size] = self.ids[top]
+            res_sims[i:i + batch_size] = np.take_along_axis(sims, top, axis=1)
+        return res_ids, res_sims
+
+    def save(self, fn):
+        np.savez(fn, vecs=self.vecs, ids=self.ids, cents=self.cents,
+            assign=self.assign, n_probe=self.n_probe)
+
+    @classmethod
+    def load(cls, fn):
+        data = np.load(fn)
+        index = cls(n_lists=len(data['cents']), n_probe=int(data['n_probe']))
+        index.vecs = data['vecs']
+        index.ids = data['ids']
+        index.cents = data['cents']
+        index.assign = data['assign']
+        index._make_lists()
+        return index
+
+
+def index_fn(exp_id, folder='data'):
+    return os.path.join(folder, '{}-ivf.npz'.format(exp_id))
+
+
+def build_index(exp_id, embs, folder='data', **kwargs):
+    index = IVFIndex(**kwargs).build(embs)
+    index.save(index_fn(exp_id, folder=folder))
+    return index
+
+
+def load_index(exp_id, folder='data'):
+    return IVFIndex.load(index_fn(exp_id, folder=folder))
@@ -0,0 +1,118 @@
+import numpy as np
+import os
+
+
+def scorer_fn(model_fn):
+    return os.path.splitext(model_fn)[0] + '-scorer.npz'
+
+
+def relevance_matrix_fn(model_fn):
+    return os.path.splitext(model_fn)[0] + '-relv.npy'
+
+
+def export_relevance(model, fn):
+    # model is the keras graph from KerasDeep._build_model
+    dense = [layer for layer in model.layers
+        if layer.__class__.__name__ == 'Dense' and layer.name != 'similarity']
+    arrays = {'sym_embs': model.get_layer('symbol_emb').get_weights()[0]}
+    for i, layer in enumerate(dense):
+        arrays['kernel_{}'.format(i)], arrays['bias_{}'.format(i)] = layer.get_weights()
+    out_kernel, out_bias = model.get_layer('similarity').get_weights()
+    arrays['out_kernel'] = out_kernel
+    arrays['out_bias'] = out_bias
+    np.savez(fn, n_layers=len(dense), **arrays)
+
+
+class RelevanceScorer:
+
+    def __init__(self, sym_embs, layers, out_kernel, out_bias):
+        self.sym_embs = _l2_normalize(sym_embs.astype(np.float32))
+        self.layers = [(k.astype(np.float32), b.astype(np.float32)) for k, b in layers]
+        self.out_w = float(out_kernel.squeeze())
+        self.out_b = float(out_bias.squeeze())
+
+    @classmethod
+    def load(cls, fn):
+        data = np.load(fn)
+        layers = [(data['kernel_{}'.format(i)], data['bias_{}'.format(i)]) for i in range(int(data['n_layers']))]
+        return cls(data['sym_embs'], layers, data['out_kernel'], data['out_bias'])
+
+    def embed_articles(self, art_embs, batch_size=8192):
+        out = np.empty((len(art_embs), self.layers[-1][0].shape[1]), dtype=np.float32)
+        for i in range(0, len(art_embs), batch_size):
+            x = np.asarray(art_embs[i:i + batch_size], dtype=np.float32)
+            for kernel, bias in self.layers:
+                x = np.maximum(x @ kernel + bias, 0)
+            out[i:i + batch_size] = _l2_normalize(x)
+        return out
+
+    def _activate(self, cos):
+        return 1 / (1 + np.exp(-(cos * self.out_w + self.out_b)))
+
+    def score(self, sym_idxs, art_embs):
+        # elementwise pairs, same as model.predict([sym_idxs, art_embs])
+        cos = np.einsum('ij,ij->i', self.sym_embs[np.asarray(sym_idxs)], self.embed_articles(art_embs))
+        return self._activate(cos)
+
+    def score_matrix(self, sym_idxs, art_embs):
+        # every symbol against every article, (len(sym_idxs), len(art_embs))
+        return self._activate(self.sym_embs[np.asarray(sym_idxs)] @ self.embed_articles(art_embs).T)
+
+
+def bake_relevance_matrix(scorer, art_embs, fn, batch_size=4096, dtype=np.float32, extend=True):
+    # symbol major so one symbol's relevance over all articles is contiguous.
+    # with extend, a matrix already at fn for fewer articles keeps its
+    # columns and only the articles after them are scored
+    sym_idxs = np.arange(len(scorer.sym_embs))
+    start = min(relevance_matrix_size(fn, n_symbols=len(sym_idxs)), len(art_embs)) if extend else 0
+    tmp_fn = fn + '.tmp'
+    relv = np.lib.format.open_memmap(tmp_fn, mode='w+', dtype=dtype, shape=(len(sym_idxs), len(art_embs)))
+    if start > 0:
+        old = load_relevance_matrix(fn)
+        for i in sym_idxs:
+            relv[i, :start] = old[i, :start]
+        del old
+    for i in range(start, len(art_embs), batch_size):
+        relv[:, i:i + batch_size] = scorer.score_matrix(sym_idxs, art_embs[i:i + batch_size])
+    relv.flush()
+    del relv
+    os.replace(tmp_fn, fn)
+
+
+def relevance_matrix_size(fn, n_symbols=None):
+    # how many articles the matrix at fn covers, 0 if there is none or it
+    # was made for another number of symbols
+    if not os.path.exists(fn):
+        return 0
+    relv = load_relevance_matrix(fn)
+    if n_symbols is not None and relv.shape[0] != n_symbols:
+        return 0
+    return relv.shape[1]
+
+
+def load_relevance_matrix(fn):
+    return np.load(fn, mmap_mode='r')
+
+
+def _l2_normalize(x):
+    # matches keras backend l2_normalize used by Dot(normalize=True)
+    return x / np.sqrt(np.maximum(np.square(x).sum(axis=1, keepdims=True), 1e-12))
+
+
+def check_scorer(model, scorer, art_embs, n=2048, seed=1337):
+    rand = np.random.RandomState(seed)
+    n_syms = len(scorer.sym_embs)
+    sym_idxs = rand.randint(0, n_syms, n)
+    art_embs = art_embs[rand.randint(0, len(art_embs), n)]
+    expected = model.predict([sym_idxs, art_embs]).squeeze(axis=1)
+    return float(np.abs(scorer.score(sym_idxs, art_embs) - expected).max())
+
+
+def query_companies(scorer, index, art_embs, k=10):
+    # the k most relevant companies for each article from a company index
+    # built over the same model's company embeddings, ids are symbol idxs.
+    # relevance is monotonic in the cosine, reversed if out_w < 0, so the
+    # query flips the article vectors in that case
+    sign = 1.0 if scorer.out_w >= 0 else -1.0
+    ids, sims = index.query(sign * scorer.embed_articles(art_embs), k=k)
+    return ids, np.where(ids >= 0, scorer._activate(sign * sims), np.nan)
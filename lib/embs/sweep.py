@@ -0,0 +1,84 @@
+from dataset.util import share_arrays, attach_arrays, worker_pool, WORKER
+import pandas as pd
+import time
+import os
+
+
+SWEEP_FN = os.path.join('data', 'company-embs-sweep.csv')
+THREAD_ENV_VARS = [
+    'OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+    'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'
+]
+
+def _setup_worker(shared_specs, sym_to_idx, sym_to_art_idxs, dataset, plot_labels):
+    shms, art_embs = attach_arrays(shared_specs)
+    return {
+        'shms': shms,
+        'art_embs': art_embs,
+        'sym_to_idx': sym_to_idx,
+        'sym_to_art_idxs': sym_to_art_idxs,
+        'dataset': dataset,
+        'plot_labels': plot_labels
+    }
+
+
+def _train_config(config):
+    # imported here so the thread limits are set before tensorflow loads
+    from embs.companies import KerasDeep
+    art_exp_id, latent_size, post_emb_layers = config
+    start = time.time()
+    test = KerasDeep(art_exp_id, WORKER['art_embs'][art_exp_id],
+        WORKER['sym_to_idx'], WORKER['sym_to_art_idxs'],
+        latent_size=latent_size, post_emb_layers=post_emb_layers
+    )
+    test.dataset = WORKER['dataset']
+    test.prep()
+    test.bake_embs()
+    if WORKER['plot_labels'] is not None:
+        test.plot('Sector', *WORKER['plot_labels'])
+    test.save_all()
+    return {
+        'exp_id': test.exp_id,
+        'art_exp_id': art_exp_id,
+        'latent_size': latent_size,
+        'post_emb_layers': post_emb_layers,
+        'val_accuracy': test.val_accuracy,
+        'epochs': len(test.history['val_accuracy']),
+        'seconds': time.time() - start
+    }
+
+
+def read_sweep(fn=SWEEP_FN):
+    if not os.path.exists(fn):
+        return pd.DataFrame(columns=['art_exp_id', 'latent_size', 'post_emb_layers'])
+    return pd.read_csv(fn)
+
+
+def run_sweep(art_embs_by_id, configs, sym_to_idx, sym_to_art_idxs, dataset,
+        procs=4, threads_per_proc=2, plot_labels=None, fn=SWEEP_FN):
+
+    done = read_sweep(fn)
+    done_keys = set(zip(done['art_exp_id'], done['latent_size'], done['post_emb_layers']))
+    todo = [c for c in configs if c not in done_keys]
+    print('Sweep:', len(configs) - len(todo), 'done,', len(todo), 'to run')
+    if len(todo) == 0:
+        return done
+
+    # the workers start with these so they are set before tensorflow loads,
+    # the parent's own values are left as they were
+    env = {var: str(threads_per_proc) for var in THREAD_ENV_VARS}
+    env['HEADLESS'] = '1'
+
+    needed = {c[0] for c in todo}
+    shms, specs = share_arrays({k: v for k, v in art_embs_by_id.items() if k in needed})
+    try:
+        with worker_pool(procs, _setup_worker, (specs, sym_to_idx, sym_to_art_idxs, dataset, plot_labels),
+                spawn=True, shms=shms, env=env) as pool:
+            for row in pool.imap_unordered(_train_config, todo):
+                print('Finished', row['exp_id'], 'val_accuracy={:.4f} in {:.0f}s'.format(row['val_accuracy'], row['seconds']))
+                # append as we go so an interrupted sweep can resume
+                pd.DataFrame([row]).to_csv(fn, mode='a', header=not os.path.exists(fn), index=False)
+    except KeyboardInterrupt:
+        print('Interrupted!')
+
+    return read_sweep(fn)
@@ -1,9 +1,14 @@
-from dataset.util import sql_read_articles, sql_read_companies_dict
+from dataset.util import sql_read_articles, sql_read_companies_dict, dedup_texts, print_dedup_report
+from dataset.config import HEADLESS
 from embs.articles import EMBEDDINGS
+import numpy as np
 import pickle
+import glob
+import sys
+import os
 
 
-def main():
+def main(plot=not HEADLESS):
 
     comps = sql_read_companies_dict()
     articles = sql_read_articles(only_labeled=True)
@@ -15,18 +20,65 @@ def main():
     with open('data/article-embs-{}-ids.pkl'.format(len(articles)), 'wb') as pkl_file:
         pickle.dump(ids, pkl_file)
 
+    # the same text shows up under several symbols, embed each one once
+    ds_name = str(len(articles))
+    fields = {}
+    for name, docs in [('headlines', headlines), ('content', content)]:
+        uniques, inverse = dedup_texts(docs)
+        print_dedup_report(name, docs, uniques)
+        fields[name] = (docs, uniques, inverse)
+
     tests = []
 
     for Emb in EMBEDDINGS:
-        tests.append(Emb('headlines', headlines))
-        tests.append(Emb('content', content))
+        for name in ['headlines', 'content']:
+            tests.append(Emb(name, fields[name][1], ds_name=ds_name))
 
     for test in tests:
         test.prep()
         test.bake_embs()
-        test.plot('Sector', sectors)
+        docs, _, inverse = fields[test.name]
+        test.expand(docs, inverse)
+        if plot:
+            test.plot('Sector', sectors)
         test.save_all()
 
 
+def extend(folder='data'):
+
+    # embeds only the articles added since each file was baked and appends
+    # them. the file keeps its name, so the company models trained on it and
+    # their relevance matrices (gen_relevance.py) pick the new articles up
+    articles = sql_read_articles(only_labeled=True)
+    fields = {
+        'headlines': [a[2] for a in articles],
+        'content': [a[2] + '\n\n' + a[4] for a in articles]
+    }
+    for Emb in EMBEDDINGS:
+        for name, all_docs in fields.items():
+            for fn in sorted(glob.glob(os.path.join(folder, 'article-embs-*-{}-{}.npy'.format(Emb.TAG, name)))):
+                embs = np.load(fn, mmap_mode='r')
+                docs = all_docs[len(embs):]
+                if len(docs) == 0:
+                    continue
+                print('Extending', fn, 'from', len(embs), 'to', len(articles), 'articles')
+                uniques, inverse = dedup_texts(docs)
+                print_dedup_report(name, docs, uniques)
+                # article-embs-<ds_name>-<tag>-<name>, ds_name is the count at the first bake
+                test = Emb(name, uniques, ds_name=os.path.basename(fn).split('-')[2])
+                try:
+                    new_embs = np.asarray(test.embed_more(uniques, folder=folder))[inverse]
+                except NotImplementedError as e:
+                    print('Cannot extend', fn + ':', e)
+                    continue
+                tmp_fn = os.path.splitext(fn)[0] + '.tmp.npy'
+                np.save(tmp_fn, np.concatenate([embs, new_embs.astype(embs.dtype)]))
+                del embs
+                os.replace(tmp_fn, fn)
+
+
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ['extend']:
+        extend()
+    else:
+        main()
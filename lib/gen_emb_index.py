@@ -0,0 +1,28 @@
+from dataset.util import sql_find_models, register_legacy_models
+from embs.articles import load_embs_from_exp_id
+from embs.index import build_index
+import numpy as np
+import glob
+import os
+
+
+ART_EXP_IDS = [
+    os.path.splitext(os.path.basename(fn))[0]
+    for fn in glob.iglob(os.path.join('data', 'article-embs-*-*-*.npy'))
+]
+
+
+def main():
+
+    for exp_id in ART_EXP_IDS:
+        print('Indexing', exp_id)
+        build_index(exp_id, load_embs_from_exp_id(exp_id))
+
+    register_legacy_models()
+    for model in sql_find_models():
+        print('Indexing', model['exp_id'])
+        build_index(model['exp_id'], np.load(model['embs_path']), n_lists=1)
+
+
+if __name__ == "__main__":
+    main()
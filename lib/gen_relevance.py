@@ -0,0 +1,45 @@
+from dataset.util import sql_find_models, register_legacy_models
+from embs.articles import load_embs_from_exp_id
+from embs.relevance import (
+    RelevanceScorer, export_relevance, scorer_fn, check_scorer,
+    bake_relevance_matrix, relevance_matrix_fn, relevance_matrix_size
+)
+from keras.models import load_model
+import numpy as np
+import os
+
+
+def export_scorers(refresh=False):
+    for relv_model in sql_find_models():
+        fn = scorer_fn(relv_model['path'])
+        if os.path.exists(fn) and not refresh:
+            continue
+        print('Exporting', relv_model['exp_id'])
+        model = load_model(relv_model['path'])
+        export_relevance(model, fn)
+        art_embs = load_embs_from_exp_id(relv_model['art_exp_id'])
+        print('NumPy scorer max abs diff:', check_scorer(model, RelevanceScorer.load(fn), art_embs))
+
+
+def bake_matrices(refresh=False):
+    # matrices behind their article embeddings (gen_article_embs.py extend)
+    # only score the new articles, refresh rebuilds them from scratch
+    for relv_model in sql_find_models():
+        fn = relevance_matrix_fn(relv_model['path'])
+        art_embs = np.load(relv_model['art_embs_path'], mmap_mode='r')
+        done = relevance_matrix_size(fn)
+        if done >= len(art_embs) and not refresh:
+            continue
+        print('Computing relevance matrix', relv_model['exp_id'], 'for', len(art_embs) - (0 if refresh else done), 'articles')
+        scorer = RelevanceScorer.load(scorer_fn(relv_model['path']))
+        bake_relevance_matrix(scorer, art_embs, fn, extend=not refresh)
+
+
+def main():
+    register_legacy_models()
+    export_scorers()
+    bake_matrices()
+
+
+if __name__ == "__main__":
+    main()
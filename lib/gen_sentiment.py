@@ -1,9 +1,36 @@
-from dataset.util import sql_read_articles
-from sentiment.articles import SENTIMENT_ALGOS
+from dataset.util import sql_read_articles, dedup_texts, print_dedup_report
+from dataset.config import HEADLESS
+from sentiment.articles import SENTIMENT_ALGOS, SENTIMENT_BY_TAG, store_legacy_sentiment
+from sentiment.store import SentimentStore, store_dir, list_stores
+from sentiment.runner import bake_parallel, clear_partial
 import pickle
+import glob
+import time
+import sys
+import os
 
 
-def main():
+def migrate_legacy():
+    # data/article-sentiment-*.npy from before data/sentiment/ existed
+    for fn in glob.glob(os.path.join('data', 'article-sentiment-*-*-*.npy')):
+        exp_id = os.path.splitext(os.path.basename(fn))[0]
+        if not os.path.exists(os.path.join(store_dir(exp_id), 'meta.json')):
+            print('Converting', fn)
+            store_legacy_sentiment(fn)
+
+
+def _bake(test):
+    if test.PARALLEL:
+        rate = bake_parallel(test)
+    else:
+        start = time.time()
+        test.prep()
+        test.bake_sentiment()
+        rate = len(test.docs) / (time.time() - start)
+    print(test.exp_id, '{:.1f} docs/sec'.format(rate))
+
+
+def main(plot=not HEADLESS):
 
     articles = sql_read_articles(only_labeled=True)
     ids = [a[0] for a in articles]
@@ -13,18 +40,61 @@ def main():
     with open('data/article-sentiment-{}-ids.pkl'.format(len(articles)), 'wb') as pkl_file:
         pickle.dump(ids, pkl_file)
 
+    # the same text shows up under several symbols, score each one once
+    ds_name = str(len(articles))
+    fields = {}
+    for name, docs in [('headlines', headlines), ('content', content)]:
+        uniques, inverse = dedup_texts(docs)
+        print_dedup_report(name, docs, uniques)
+        fields[name] = (docs, uniques, inverse)
+
     tests = []
 
     for SentAlgo in SENTIMENT_ALGOS:
-        tests.append(SentAlgo('headlines', headlines))
-        tests.append(SentAlgo('content', content))
+        for name in ['headlines', 'content']:
+            tests.append(SentAlgo(name, fields[name][1], ds_name=ds_name))
 
     for test in tests:
-        test.prep()
-        test.bake_sentiment()
-        test.plot()
+        _bake(test)
+        docs, _, inverse = fields[test.name]
+        test.expand(docs, inverse)
+        if plot:
+            test.plot()
         test.save_all()
+        clear_partial(test)
+
+
+def extend():
+
+    # scores only the articles added since each store was baked and appends
+    # them, the store keeps its folder, so the names built from it downstream,
+    # and the scaling of its bake
+    articles = sql_read_articles(only_labeled=True)
+    fields = {
+        'headlines': [a[2] for a in articles],
+        'content': [a[2] + '\n\n' + a[4] for a in articles]
+    }
+    for sent_dir in list_stores():
+        store = SentimentStore.open(sent_dir)
+        meta = store.meta
+        docs = fields[meta['field']][len(store.raw):]
+        if len(docs) == 0:
+            continue
+        print('Extending', sent_dir, 'from', len(store.raw), 'to', len(articles), 'articles')
+        uniques, inverse = dedup_texts(docs)
+        print_dedup_report(meta['field'], docs, uniques)
+        test = SENTIMENT_BY_TAG[meta['method']](meta['field'], uniques, ds_name=meta['ds_name'])
+        _bake(test)
+        test.expand(docs, inverse)
+        extended = store.extend(test.doc_sent)
+        # the old arrays are memmaps of the files about to be replaced
+        del store
+        extended.save(sent_dir)
+        clear_partial(test)
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ['extend']:
+        extend()
+    else:
+        main()
@@ -1,6 +1,8 @@
 from dataset.util import sql_read_articles, sql_read_companies_dict
+from dataset.config import HEADLESS, MAX_PROCS
+from dataset.corpus import CorpusIndex
 from embs.articles import load_embs_from_exp_id
-from embs.companies import KerasDeep
+from embs.sweep import run_sweep
 import numpy as np
 import random
 import pickle
@@ -14,37 +16,20 @@ EXP_IDS = [
 ]
 
 
-def _make_dataset(art_embs, sym_to_idx, sym_to_art_idxs):
-    S = []
-    A = []
-    Y = []
-    all_ids = list(range(len(art_embs)))
-    for sym, sym_idx in sym_to_idx.items():
-        sym_arts = sym_to_art_idxs[sym]
-        for art_id in sym_arts:
-            S.append(sym_idx)
-            A.append(art_embs[art_id])
-            Y.append(1)
-        nsym_arts = []
-        for _ in sym_arts:
-            nart_id = sym_arts[0]
-            while nart_id in sym_arts or nart_id in nsym_arts:
-                nart_id = random.choice(all_ids)
-            nsym_arts.append(nart_id)
-            S.append(sym_idx)
-            A.append(art_embs[nart_id])
-            Y.append(0)
-    S = np.array(S)
-    A = np.array(A)
-    Y = np.array(Y)
-    rand_ord = np.random.permutation(S.shape[0])
-    S = S[rand_ord]
-    A = A[rand_ord]
-    Y = Y[rand_ord]
-    return S, A, Y
+def _make_dataset(sym_to_idx, sym_to_art_idxs):
+    # positive (symbol, article) pairs only, negatives are drawn per epoch
+    S = np.concatenate([
+        np.full(len(sym_to_art_idxs[sym]), sym_idx, dtype=np.int64)
+        for sym, sym_idx in sym_to_idx.items()
+    ])
+    A = np.concatenate([
+        np.asarray(sym_to_art_idxs[sym], dtype=np.int64)
+        for sym in sym_to_idx
+    ])
+    return S, A
 
 
-def main():
+def main(plot=not HEADLESS, procs=MAX_PROCS // 2, threads_per_proc=2):
 
     comps = sql_read_companies_dict()
     articles = sql_read_articles(only_labeled=True)
@@ -59,37 +44,27 @@ def main():
     with open('data/company-embs-{}-map.pkl'.format(len(comps)), 'wb') as pkl_file:
         pickle.dump(sym_to_idx, pkl_file)
 
+    corpus = CorpusIndex(articles)
     sym_to_art_idxs = {}
     for sym in comps:
-        art_idxs = [i for i, a in enumerate(articles) if a[1] == sym]
+        art_idxs = corpus.symbols[sym].tolist()
         random.shuffle(art_idxs)
         sym_to_art_idxs[sym] = art_idxs
 
-    tests = []
+    dataset = _make_dataset(sym_to_idx, sym_to_art_idxs)
 
+    art_embs_by_id = {}
+    configs = []
     for art_exp_id in EXP_IDS:
-        
-        art_embs = load_embs_from_exp_id(art_exp_id)
-
-        art_emb_tests = []
+        art_embs_by_id[art_exp_id] = load_embs_from_exp_id(art_exp_id)
         for ls in [2024, 1024, 512, 65]:
             for layers in [0, 1, 3]:
-                art_emb_tests.append(KerasDeep(art_exp_id, art_embs, 
-                    sym_to_idx, sym_to_art_idxs, 
-                    latent_size=ls, post_emb_layers=layers
-                ))
-
-        dataset = _make_dataset(art_embs, sym_to_idx, sym_to_art_idxs)
-        for test in art_emb_tests:
-            test.dataset = dataset
-        tests.extend(art_emb_tests)
+                configs.append((art_exp_id, ls, layers))
 
-    for test in tests:
-        print(test.exp_id)
-        test.prep()
-        test.bake_embs()
-        test.plot('Sector', sectors, names)
-        test.save_all()
+    summary = run_sweep(art_embs_by_id, configs, sym_to_idx, sym_to_art_idxs, dataset,
+        procs=procs, threads_per_proc=threads_per_proc,
+        plot_labels=(sectors, names) if plot else None)
+    print(summary.sort_values('val_accuracy', ascending=False).to_string(index=False))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+from dataset.util import sql_read_articles, sql_find_model
+from embs.articles import load_embs_from_exp_id
+from embs.relevance import RelevanceScorer, scorer_fn, query_companies
+from embs.index import load_index
+import numpy as np
+import pickle
+import glob
+import os
+
+
+COMP_MAP_FN = glob.glob(os.path.join('data', 'company-embs-*-map.pkl'))[0]
+
+
+def similar_articles(art_exp_id, art_idxs, k=10):
+    # (ids, sims) of the k nearest articles for each of art_idxs, ids index
+    # sql_read_articles(only_labeled=True) like the embeddings do
+    embs = load_embs_from_exp_id(art_exp_id)
+    return load_index(art_exp_id).query(embs[art_idxs], k=k + 1)
+
+
+def closest_companies(embs_substring, art_idxs, k=10):
+    # (symbols, relevance) of the k most relevant companies for each article
+    model = sql_find_model(embs_substring)
+    scorer = RelevanceScorer.load(scorer_fn(model['path']))
+    art_embs = load_embs_from_exp_id(model['art_exp_id'])[art_idxs]
+    ids, relv = query_companies(scorer, load_index(model['exp_id']), art_embs, k=k)
+    with open(COMP_MAP_FN, 'rb') as f:
+        idx_to_sym = {idx: sym for sym, idx in pickle.load(f).items()}
+    return [[idx_to_sym.get(i) for i in row] for row in ids], relv
+
+
+def main(embs_substring='counts-content-keras-1024-3', n=5, k=5):
+
+    articles = sql_read_articles(only_labeled=True)
+    art_idxs = np.random.RandomState(1337).choice(len(articles), n, replace=False)
+    model = sql_find_model(embs_substring)
+
+    art_ids, art_sims = similar_articles(model['art_exp_id'], art_idxs, k=k)
+    symbols, relv = closest_companies(embs_substring, art_idxs, k=k)
+    for i, art_idx in enumerate(art_idxs):
+        print('[{}] {}'.format(articles[art_idx][1], articles[art_idx][2]))
+        print('  companies:', ', '.join('{} {:.3f}'.format(s, r) for s, r in zip(symbols[i], relv[i])))
+        for j, sim in zip(art_ids[i], art_sims[i]):
+            if j != art_idx and j >= 0:
+                print('  {:.3f} [{}] {}'.format(sim, articles[j][1], articles[j][2]))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,22 +2,31 @@ from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from allennlp.predictors.predictor import Predictor
 from google.cloud import language_v1 as language
 from google.cloud.language_v1 import enums
+from google.api_core import exceptions as gcp_exceptions
 from textblob import TextBlob
+from dataset.config import HEADLESS, FAST_VADER
+from sentiment.lexicon import LexiconScorer
+from sentiment.client import ConcurrentScorer
+from sentiment.store import SentimentStore, store_dir, standardize as standardize_scores
 import plotly.express as px
 import pandas as pd
 import numpy as np
 import pickle
-import time
 import os
 
 
 class AbstractSentiment:
 
     TAG = 'abs'
+    PARALLEL = True
+    # field name -> transform applied before z-scoring, see sentiment.store
+    TRANSFORMS = {}
 
     def __init__(self, name, docs, ds_name=None):
         if ds_name is None:
             ds_name = str(len(docs))
+        self.name = name
+        self.ds_name = ds_name
         self.docs = docs
         self.exp_id = 'article-sentiment-{}-{}-{}'.format(ds_name, self.TAG, name)
         self.exp_name = 'Article Sentiment ({} on {})'.format(self.TAG, name)
@@ -29,6 +38,11 @@ class AbstractSentiment:
 
     def bake_sentiment(self):
         raise NotImplementedError()
+
+    def expand(self, docs, inverse):
+        # scatter scores baked on unique docs back to every row
+        self.docs = docs
+        self.doc_sent = self.doc_sent[inverse]
     
     def plot(self):
         df = pd.DataFrame({
@@ -36,11 +50,13 @@ class AbstractSentiment:
             'doc': [d[:50] for d in self.docs]
         })
         self.figs["hist"] = px.histogram(df, x="score", title=self.exp_name)
-        self.figs["hist"].show()
+        if not HEADLESS:
+            self.figs["hist"].show()
 
     def save_all(self, folder='data'):
-        fn_sent = os.path.join(folder, '{}.npy'.format(self.exp_id))
-        np.save(fn_sent, self.doc_sent)
+        store = SentimentStore.from_scores(self.doc_sent, transform=self.TRANSFORMS.get(self.name, 'none'),
+            exp_id=self.exp_id, method=self.TAG, field=self.name, ds_name=self.ds_name)
+        store.save(store_dir(self.exp_id, folder=os.path.join(folder, 'sentiment')))
         if len(self.figs) > 0:
             for name, fig in self.figs.items():
                 fn_fig = os.path.join(folder, '{}-{}.png'.format(self.exp_id, name))
@@ -61,6 +77,7 @@ class TextBlobSentiment(AbstractSentiment):
 class VADERSentiment(AbstractSentiment):
 
     TAG = 'vader'
+    TRANSFORMS = {'content': 'log_half'}
 
     def prep(self):
         self.sia = SentimentIntensityAnalyzer()
@@ -74,68 +91,122 @@ class VADERSentiment(AbstractSentiment):
         self.doc_sent = np.array([self._score(doc) for doc in self.docs])
 
 
+class VADERFastSentiment(VADERSentiment):
+
+    # VADERSentiment batched over the whole corpus, agrees with it on the
+    # bench_sentiment.py checks, FAST_VADER=1 bakes with this one instead
+    TAG = 'vaderfast'
+    PARALLEL = False
+
+    def prep(self):
+        super().prep()
+        self.scorer = LexiconScorer(self.sia.lexicon)
+
+    def bake_sentiment(self):
+        self.doc_sent = self.scorer.score(self.docs)
+
+
 class AllenNLPGlove(AbstractSentiment):
 
     TAG = 'allenglove'
+    PARALLEL = False
+    TRANSFORMS = {'headlines': 'log', 'content': 'log'}
+    MODEL_URL = "https://s3-us-west-2.amazonaws.com/allennlp/models/sst-2-basic-classifier-glove-2019.06.27.tar.gz"
+    MODEL_FN = os.path.join('data', 'sst-2-basic-classifier-glove-2019.06.27.tar.gz')
+
+    def __init__(self, name, docs, ds_name=None, batch_size=64, model_path=None):
+        super().__init__(name, docs, ds_name=ds_name)
+        self.batch_size = batch_size
+        if model_path is None:
+            # a downloaded copy of the archive in data/ keeps this offline
+            model_path = self.MODEL_FN if os.path.exists(self.MODEL_FN) else self.MODEL_URL
+        self.model_path = model_path
 
     def prep(self):
-        self.model = Predictor.from_path("https://s3-us-west-2.amazonaws.com/allennlp/models/sst-2-basic-classifier-glove-2019.06.27.tar.gz")
+        self.model = Predictor.from_path(self.model_path)
 
     def _score(self, doc):
         return self.model.predict(sentence=doc)['probs'][0] - 0.5
 
     def bake_sentiment(self):
-        self.doc_sent = np.array([self._score(doc) for doc in self.docs])
+        # sorted by length so each batch only pads up to similar sized docs
+        order = np.argsort([len(doc.split()) for doc in self.docs], kind='stable')
+        self.doc_sent = np.zeros(len(self.docs))
+        for i in range(0, len(order), self.batch_size):
+            idxs = order[i:i + self.batch_size]
+            preds = self.model.predict_batch_json([{'sentence': self.docs[j]} for j in idxs])
+            self.doc_sent[idxs] = [pred['probs'][0] - 0.5 for pred in preds]
 
 
 class GoogleCloud(AbstractSentiment):
 
     TAG = 'gcp'
+    PARALLEL = False
+    # default natural language quota is 600 requests/min
+    QPS = 10
+    MAX_IN_FLIGHT = 8
+    CACHE_FN = os.path.join('data', 'gcp-sentiment-cache.sqlite')
+    TRANSIENT_ERRORS = (
+        gcp_exceptions.TooManyRequests,
+        gcp_exceptions.ResourceExhausted,
+        gcp_exceptions.ServiceUnavailable,
+        gcp_exceptions.InternalServerError,
+        gcp_exceptions.DeadlineExceeded,
+        ConnectionError
+    )
 
     def prep(self):
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.path.join('data', 'gcp.json')
         self.gcp_client = language.LanguageServiceClient()
+        self.client = ConcurrentScorer(self._analyze, rate=self.QPS, max_in_flight=self.MAX_IN_FLIGHT,
+            is_transient=lambda e: isinstance(e, self.TRANSIENT_ERRORS), cache_fn=self.CACHE_FN)
 
-    def _score(self, doc):
+    def _analyze(self, doc):
         document = {'content': doc, 'type': enums.Document.Type.PLAIN_TEXT, 'language': 'en'}
-        try:
-            doc_resp = self.gcp_client.analyze_sentiment(document, encoding_type=enums.EncodingType.UTF8)
-            polarity = doc_resp.document_sentiment.score
-            mag = doc_resp.document_sentiment.magnitude
-            time.sleep(0.2)  # just to be safe
-            return polarity
-        except Exception as e:
-            print(e)
-            return -1000
+        doc_resp = self.gcp_client.analyze_sentiment(document, encoding_type=enums.EncodingType.UTF8)
+        return doc_resp.document_sentiment.score
 
     def bake_sentiment(self):
-        self.doc_sent = np.array([self._score(doc) for doc in self.docs])
+        # docs that failed every retry are nan instead of a sentinel
+        self.doc_sent = self.client.score(self.docs)
+        print(self.exp_id, self.client.stats)
+
+
+def _legacy_transform(fn):
+    if '-vader-content' in fn or '-vaderfast-content' in fn:
+        return 'log_half'
+    elif '-allenglove-' in fn:
+        return 'log'
+    return 'none'
 
 
 def load_sentiment(fn, standardize=True):
-    data = np.load(fn)
+    # old style data/article-sentiment-*.npy, new bakes go to sentiment.store
+    data = np.load(fn).astype(np.float64)
+    # older gcp files marked failed requests with -1000
+    if '-gcp-' in fn:
+        data[data == -1000] = np.nan
     if standardize:
-        if '-gcp-' in fn:
-            clean_idxs = (data != -1000)
-            data = (data - data[clean_idxs].mean()) / data[clean_idxs].std()
-            data[~clean_idxs] = -1000
-        elif '-vader-content' in fn:
-            temp = np.abs(data / 2)
-            temp[temp == 0] = 0.001
-            data = -np.sign(data) * (np.log(temp) + np.log(2))
-            data = (data - data.mean()) / data.std()
-        elif '-allenglove-' in fn:
-            data = -np.sign(data) * (np.log(np.abs(data)) + np.log(2))
-            data = (data - data.mean()) / data.std()
-        else:
-            data = (data - data.mean()) / data.std()
-        data = np.clip(data, -3, 3)
+        data = standardize_scores(data, transform=_legacy_transform(fn))[0]
     return data
 
 
+def store_legacy_sentiment(fn, folder='data'):
+    exp_id = os.path.splitext(os.path.basename(fn))[0]
+    ds_name, tag, name = exp_id.split('-')[2:5]
+    store = SentimentStore.from_scores(load_sentiment(fn, standardize=False),
+        transform=_legacy_transform(fn), exp_id=exp_id, method=tag, field=name, ds_name=ds_name)
+    store.save(store_dir(exp_id, folder=os.path.join(folder, 'sentiment')))
+
+
 SENTIMENT_ALGOS = [
     TextBlobSentiment,
-    VADERSentiment,
+    VADERFastSentiment if FAST_VADER else VADERSentiment,
     AllenNLPGlove,
     GoogleCloud
-]
\ No newline at end of file
+]
+
+# every algorithm by TAG, stores remember theirs whichever VADER mode is on
+SENTIMENT_BY_TAG = {SentAlgo.TAG: SentAlgo for SentAlgo in [
+    TextBlobSentiment, VADERSentiment, VADERFastSentiment, AllenNLPGlove, GoogleCloud
+]}
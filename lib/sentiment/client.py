@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import threading
+import hashlib
+import sqlite3
+import random
+import time
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=1):
+        # rate is requests/sec, burst is how many can go out back to back
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ScoreCache:
+
+    # text hash -> score, only successful scores ever get stored
+    def __init__(self, fn):
+        self.conn = sqlite3.connect(fn)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS scores (key VARCHAR(40) PRIMARY KEY, score REAL)')
+        self.conn.commit()
+
+    def get_many(self, keys, batch_size=500):
+        found = {}
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            rows = self.conn.execute('SELECT key, score FROM scores WHERE key IN ({})'.format(
+                ','.join('?' * len(batch))), batch).fetchall()
+            found.update(rows)
+        return found
+
+    def put_many(self, items):
+        self.conn.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?)', items)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class ConcurrentScorer:
+
+    def __init__(self, analyze, rate=10, max_in_flight=8, max_retries=5, backoff=0.5,
+            is_transient=lambda e: True, cache_fn=None, flush_every=100):
+        # analyze(text) -> float is called from worker threads, anything it
+        # raises that is_transient() accepts is retried with exponential backoff
+        self.analyze = analyze
+        self.bucket = TokenBucket(rate)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.is_transient = is_transient
+        self.cache_fn = cache_fn
+        self.flush_every = flush_every
+        self.stats = {'requests': 0, 'retries': 0, 'failed': 0, 'cached': 0}
+        self.lock = threading.Lock()
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _call(self, text):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self._count('requests')
+            try:
+                return self.analyze(text)
+            except Exception as e:
+                if attempt == self.max_retries or not self.is_transient(e):
+                    print(e)
+                    return np.nan
+                self._count('retries')
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    def score(self, docs):
+        # nan for docs that still failed, they are not cached so the next run retries them
+        keys = [text_key(doc) for doc in docs]
+        cache = ScoreCache(self.cache_fn) if self.cache_fn is not None else None
+        found = cache.get_many(keys) if cache is not None else {}
+        self.stats['cached'] += len(found)
+
+        scores = np.array([found.get(key, np.nan) for key in keys])
+        todo = [i for i, key in enumerate(keys) if key not in found]
+        pending = []
+        # the semaphore keeps at most max_in_flight requests submitted at once
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+
+        def run(i):
+            try:
+                return i, self._call(docs[i])
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            futures = []
+            for i in todo:
+                slots.acquire()
+                futures.append(pool.submit(run, i))
+                futures = self._collect(futures, scores, keys, pending, cache)
+            for future in futures:
+                future.result()
+            self._collect(futures, scores, keys, pending, cache, flush=True)
+
+        if cache is not None:
+            cache.close()
+        self.stats['failed'] = int(np.isnan(scores[todo]).sum()) if len(todo) > 0 else 0
+        return scores
+
+    def _collect(self, futures, scores, keys, pending, cache, flush=False):
+        running = []
+        for future in futures:
+            if not future.done():
+                running.append(future)
+                continue
+            i, score = future.result()
+            scores[i] = score
+            if not np.isnan(score):
+                pending.append((keys[i], float(score)))
+        if cache is not None and len(pending) > 0 and (flush or len(pending) >= self.flush_every):
+            cache.put_many(pending)
+            pending.clear()
+        return running
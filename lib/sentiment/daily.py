@@ -0,0 +1,34 @@
+import numpy as np
+
+
+def segment_sum(values, offsets):
+    # sum over the last axis within [offsets[i], offsets[i + 1]), empty segments are 0
+    sizes = np.diff(offsets)
+    out = np.zeros(values.shape[:-1] + (len(sizes),), dtype=np.float64)
+    nonempty = sizes > 0
+    if nonempty.any():
+        out[..., nonempty] = np.add.reduceat(values, offsets[:-1][nonempty], axis=-1)
+    return out
+
+
+def daily_means(values, valid, by_date, dates=None):
+    # values is (..., n_articles) and valid is (n_articles,), by_date a dataset.corpus.Grouping
+    # returns (..., n_dates) means over valid articles, nan where a day has none
+    rows = by_date.rows
+    day_valid = valid[rows]
+    day_values = np.where(day_valid, values[..., rows], 0).astype(np.float64, copy=False)
+    sums = segment_sum(day_values, by_date.offsets)
+    counts = segment_sum(day_valid.astype(np.float64), by_date.offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    means[..., counts == 0] = np.nan
+    if dates is not None:
+        means = means[..., [by_date.key_to_group[d] for d in dates]]
+    return means
+
+
+def daily_relevance_sentiment(relv, sent, valid, by_date, dates=None):
+    # relv is (n_symbols, n_articles), one daily series per symbol
+    relv = np.asarray(relv)
+    sent = np.where(valid, sent, 0).astype(np.float64, copy=False)
+    return daily_means(relv * sent, valid, by_date, dates=dates)
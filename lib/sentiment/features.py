@@ -0,0 +1,114 @@
+from scipy.signal import lfilter
+import numpy as np
+
+
+WINDOWS = [5, 7, 10, 30]
+
+
+def ewm_mean(x, span):
+    # same as pandas ewm(span=span).mean() (adjust=True, ignore_na=False) down axis 0
+    decay = 1 - 2 / (span + 1)
+    valid = ~np.isnan(x)
+    num = lfilter([1], [1, -decay], np.where(valid, x, 0), axis=0)
+    den = lfilter([1], [1, -decay], valid.astype(np.float64), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = num / den
+    out[den == 0] = np.nan
+    return out
+
+
+def _window_sums(x, win):
+    # sums of x[t - win + 1:t + 1] down axis 0, first win - 1 rows are 0
+    csum = np.cumsum(x, axis=0)
+    out = csum.copy()
+    out[win:] -= csum[:-win]
+    out[:win - 1] = 0
+    return out
+
+
+def rolling_mean(x, win):
+    # same as pandas rolling(win).mean(), nan unless the whole window is valid
+    valid = ~np.isnan(x)
+    sums = _window_sums(np.where(valid, x, 0), win)
+    counts = _window_sums(valid.astype(np.float64), win)
+    out = np.full(x.shape, np.nan)
+    full = counts == win
+    out[full] = sums[full] / win
+    return out
+
+
+def cumsum(x):
+    out = np.nancumsum(x, axis=0)
+    out[np.isnan(x)] = np.nan
+    return out
+
+
+def feature_columns(names, windows=WINDOWS):
+    suffixes = [s + str(win) for win in windows for s in ['_emw', '_ma']] + ['_cumsum']
+    return [name + suffix for name in names for suffix in suffixes]
+
+
+def make_features(values, names, windows=WINDOWS):
+    # values is (n_days, n_names), returns the derived columns in the
+    # name_emw5, name_ma5, ..., name_cumsum order the csvs have always used
+    values = np.asarray(values, dtype=np.float64)
+    per_name = []
+    for win in windows:
+        per_name.append(ewm_mean(values, win))
+        per_name.append(rolling_mean(values, win))
+    per_name.append(cumsum(values))
+    features = np.stack(per_name, axis=2).reshape(len(values), len(per_name) * values.shape[1])
+    return features, feature_columns(names, windows=windows)
+
+
+def _centered(x):
+    # centering first keeps the one-pass moment sums well conditioned
+    x = np.asarray(x, dtype=np.float64)
+    valid = ~np.isnan(x)
+    means = np.where(valid, x, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    return np.where(valid, x - means, 0), valid.astype(np.float64)
+
+
+def corr_block(X, Y):
+    # pairwise complete pearson correlation of every column of X (n, f)
+    # with every column of Y (n, p), the (f, p) block of DataFrame.corr()
+    X0, mx = _centered(X)
+    Y0, my = _centered(Y)
+    n = mx.T @ my
+    sx = X0.T @ my
+    sy = mx.T @ Y0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = X0.T @ Y0 - sx * sy / n
+        var_x = np.square(X0).T @ my - np.square(sx) / n
+        var_y = mx.T @ np.square(Y0) - np.square(sy) / n
+        corr = cov / np.sqrt(var_x * var_y)
+    return np.clip(corr, -1, 1)
+
+
+def lagged_corr(X, Y, lags):
+    # corr of X[t] with Y[t + lag], (len(lags), f, p)
+    out = []
+    for lag in lags:
+        if lag >= 0:
+            out.append(corr_block(X[:len(X) - lag], Y[lag:]))
+        else:
+            out.append(corr_block(X[-lag:], Y[:len(Y) + lag]))
+    return np.stack(out)
+
+
+def rolling_corr(X, y, win):
+    # pandas x.rolling(win).corr(y) for every column of X against one series y, (n, f)
+    X0, mx = _centered(X)
+    y0, my = _centered(np.asarray(y, dtype=np.float64)[:, None])
+    mask = mx * my
+    X0, y0 = X0 * mask, y0 * mask
+    n = _window_sums(mask, win)
+    sx = _window_sums(X0, win)
+    sy = _window_sums(y0, win)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = _window_sums(X0 * y0, win) - sx * sy / n
+        var_x = _window_sums(np.square(X0), win) - np.square(sx) / n
+        var_y = _window_sums(np.square(y0), win) - np.square(sy) / n
+        corr = cov / np.sqrt(var_x * var_y)
+    corr[n < win] = np.nan
+    return np.clip(corr, -1, 1)
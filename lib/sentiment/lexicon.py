@@ -0,0 +1,232 @@
+from nltk.sentiment.vader import VaderConstants
+import numpy as np
+
+
+# same constants polarity_scores uses
+C = VaderConstants()
+SO_THIS = ('so', 'this')
+AT_VERY = ('at', 'very')
+
+
+def _strip_punc(tok):
+    # SentiText._words_and_emoticons, drops one leading or trailing entry of PUNC_LIST
+    for p in C.PUNC_LIST:
+        if tok.startswith(p):
+            rest = tok[len(p):]
+        elif tok.endswith(p):
+            rest = tok[:-len(p)]
+        else:
+            continue
+        if len(rest) > 1 and C.REGEX_REMOVE_PUNCTUATION.search(rest) is None:
+            return rest
+    return tok
+
+
+def _punc_amplifier(doc):
+    ep_count = min(doc.count('!'), 4)
+    qm_count = doc.count('?')
+    qm_amp = 0.0
+    if qm_count > 1:
+        qm_amp = qm_count * 0.18 if qm_count <= 3 else 0.96
+    return ep_count * 0.292 + qm_amp
+
+
+def _sequential_sums(vals, doc_ids, n_docs):
+    # per doc sums added left to right like score_valence's sum(), a pairwise
+    # sum can land a hair off 0 where nltk gets exactly 0 and then np.sign
+    # adds the punctuation amplifier. zeros are skipped, adding them is a no-op
+    nz = np.flatnonzero(vals)
+    docs = doc_ids[nz]
+    counts = np.bincount(docs, minlength=n_docs)
+    rank = np.arange(len(nz)) - np.concatenate([[0], np.cumsum(counts)])[docs]
+    sums = np.zeros(n_docs)
+    order = np.argsort(rank, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(rank, minlength=counts.max() if len(nz) > 0 else 0))])
+    for k in range(len(bounds) - 1):
+        # the k-th non-zero value of each doc, at most one per doc
+        sel = order[bounds[k]:bounds[k + 1]]
+        sums[docs[sel]] += vals[nz[sel]]
+    return sums
+
+
+class LexiconScorer:
+
+    # batch version of SentimentIntensityAnalyzer.polarity_scores()['compound'],
+    # every doc is tokenized once into one flat array of word ids and the
+    # per-word heuristics are gathered from vocab tables instead of per token
+    # python. it follows nltk's arithmetic step by step, but it is checked
+    # against nltk (bench_sentiment.py) rather than guaranteed identical
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+        self.raw_ids = {}
+        self.word_ids = {}
+        self.words = []
+        self.props = []
+        self._tables = None
+
+    def _word_id(self, word):
+        if word not in self.word_ids:
+            lower = word.lower()
+            self.word_ids[word] = len(self.words)
+            self.words.append(word)
+            self.props.append((
+                self.lexicon.get(lower, 0.0),
+                lower in self.lexicon,
+                C.BOOSTER_DICT.get(lower, 0.0),
+                lower in C.BOOSTER_DICT,
+                word.isupper(),
+                lower in C.NEGATE or "n't" in lower,
+                lower == 'kind',
+                lower == 'of',
+                word == 'never',
+                word in SO_THIS,
+                lower == 'least',
+                lower in AT_VERY,
+                lower == 'but'
+            ))
+            self._tables = None
+        return self.word_ids[word]
+
+    def _raw_id(self, tok):
+        if tok not in self.raw_ids:
+            # single chars are dropped before anything else looks at the text
+            self.raw_ids[tok] = self._word_id(_strip_punc(tok)) if len(tok) > 1 else -1
+        return self.raw_ids[tok]
+
+    def _get_tables(self):
+        if self._tables is None:
+            names = ['lex', 'in_lex', 'boost', 'is_boost', 'upper', 'neg', 'kind', 'of',
+                'never', 'so_this', 'least', 'at_very', 'but']
+            cols = list(zip(*self.props)) or [()] * len(names)
+            self._tables = {name: np.array(col, dtype=np.float64 if name in ('lex', 'boost') else bool)
+                for name, col in zip(names, cols)}
+        return self._tables
+
+    def _phrase_starts(self, word_ids, pos, n_tok, phrases):
+        # value of the phrase (tuple of exact words) starting at each token, nan if none
+        out = np.full(len(word_ids), np.nan)
+        idxs = np.arange(len(word_ids))
+        for phrase, value in phrases.items():
+            ids = [self.word_ids.get(w, -1) for w in phrase]
+            if -1 in ids:
+                continue
+            match = pos + len(ids) <= n_tok
+            for k, word_id in enumerate(ids):
+                match &= word_ids[np.minimum(idxs + k, len(word_ids) - 1)] == word_id
+            out[match] = value
+        return out
+
+    def _tokenize(self, docs):
+        raw_get = self.raw_ids.get
+        rows = []
+        for doc in docs:
+            toks = doc.split()
+            row = [raw_get(tok) for tok in toks]
+            if None in row:
+                row = [self._raw_id(tok) for tok in toks]
+            rows.append(row)
+        lens = np.array([len(row) for row in rows], dtype=np.int64)
+        word_ids = np.fromiter((i for row in rows for i in row), dtype=np.int64, count=lens.sum())
+        doc_ids = np.repeat(np.arange(len(docs)), lens)
+        keep = word_ids >= 0
+        return word_ids[keep], doc_ids[keep]
+
+    def _valences(self, t, i, word_ids, pos, n_tok, cap_diff, idioms, boost_bigrams):
+        # sentiment_valence() for the tokens at flat positions i, all the
+        # context checks look at most 3 tokens back and 2 ahead
+        def at(offset):
+            return word_ids[np.clip(i + offset, 0, len(word_ids) - 1)]
+
+        w = word_ids[i]
+        p = pos[i]
+        val = t['lex'][w].copy()
+        val += np.where(t['upper'][w] & cap_diff, np.where(val > 0, C.C_INCR, -C.C_INCR), 0)
+
+        for start_i, damp in enumerate([1, 0.95, 0.9]):
+            prev = at(-(start_i + 1))
+            ok = (p > start_i) & ~t['in_lex'][prev]
+
+            scalar = t['boost'][prev] * np.where(val < 0, -1, 1)
+            scalar += np.where(t['is_boost'][prev] & t['upper'][prev] & cap_diff,
+                np.where(val > 0, C.C_INCR, -C.C_INCR), 0)
+            val = np.where(ok, val + scalar * damp, val)
+
+            # _never_check
+            if start_i == 0:
+                mult = np.where(t['neg'][prev], C.N_SCALAR, 1)
+            elif start_i == 1:
+                mult = np.where(t['never'][prev] & t['so_this'][at(-1)], 1.5,
+                    np.where(t['neg'][prev], C.N_SCALAR, 1))
+            else:
+                emph = (t['never'][prev] & t['so_this'][at(-2)]) | t['so_this'][at(-1)]
+                mult = np.where(emph, 1.25, np.where(t['neg'][prev], C.N_SCALAR, 1))
+            val = np.where(ok, val * mult, val)
+
+            if start_i == 2:
+                # _idioms_check, earlier sequences win then the ones after the word override
+                found = np.full(len(i), np.nan)
+                for starts, offset in [(idioms[2], -1), (idioms[3], -2), (idioms[2], -2),
+                        (idioms[3], -3), (idioms[2], -3)]:
+                    found = np.where(np.isnan(found), starts[np.clip(i + offset, 0, None)], found)
+                for starts in [idioms[2], idioms[3]]:
+                    found = np.where(np.isnan(starts[i]), found, starts[i])
+                idiom_val = np.where(np.isnan(found), val, found)
+                bigram = ~np.isnan(boost_bigrams[np.clip(i - 3, 0, None)]) \
+                    | ~np.isnan(boost_bigrams[np.clip(i - 2, 0, None)])
+                val = np.where(ok, idiom_val + np.where(bigram, C.B_DECR, 0), val)
+
+        # _least_check
+        prev = at(-1)
+        least = (p > 0) & ~t['in_lex'][prev] & t['least'][prev]
+        least &= (p == 1) | ~t['at_very'][at(-2)]
+        return np.where(least, val * C.N_SCALAR, val)
+
+    def score(self, docs, batch_size=10000):
+        return np.concatenate([self._score_batch(docs[i:i + batch_size])
+            for i in range(0, len(docs), batch_size)] + [np.zeros(0)])
+
+    def _score_batch(self, docs):
+        word_ids, doc_ids = self._tokenize(docs)
+        t = self._get_tables()
+        n_docs = len(docs)
+        lens = np.bincount(doc_ids, minlength=n_docs)
+        offsets = np.concatenate([[0], np.cumsum(lens)])
+        pos = np.arange(len(word_ids)) - offsets[doc_ids]
+        n_tok = lens[doc_ids]
+
+        n_upper = np.bincount(doc_ids, weights=t['upper'][word_ids], minlength=n_docs)
+        cap_diff = (n_upper > 0) & (n_upper < lens)
+
+        idioms = {2: {}, 3: {}}
+        for seq, value in C.SPECIAL_CASE_IDIOMS.items():
+            phrase = tuple(seq.split(' '))
+            idioms[len(phrase)][phrase] = value
+        idioms = {n: self._phrase_starts(word_ids, pos, n_tok, phrases) for n, phrases in idioms.items()}
+        boost_bigrams = self._phrase_starts(word_ids, pos, n_tok,
+            {tuple(seq.split(' ')): 1 for seq in C.BOOSTER_DICT if ' ' in seq})
+
+        # polarity_scores looks up the context of the first time a word shows
+        # up in a doc (words.index(item)) for every repeat of it
+        keys = doc_ids * len(self.words) + word_ids
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        w = word_ids[first]
+        next_of = (pos[first] + 1 < n_tok[first]) & t['of'][word_ids[np.minimum(first + 1, len(word_ids) - 1)]]
+        scored = t['in_lex'][w] & ~t['is_boost'][w] & ~(t['kind'][w] & next_of)
+        vals = np.zeros(len(first))
+        vals[scored] = self._valences(t, first[scored], word_ids, pos, n_tok,
+            cap_diff[doc_ids[first[scored]]], idioms, boost_bigrams)
+        vals = vals[inverse.ravel()]
+
+        # _but_check, half weight before the first 'but' and 1.5x after
+        is_but = t['but'][word_ids]
+        first_but = np.full(n_docs, np.iinfo(np.int64).max)
+        np.minimum.at(first_but, doc_ids[is_but], pos[is_but])
+        but_pos = first_but[doc_ids]
+        has_but = but_pos < np.iinfo(np.int64).max
+        vals *= np.where(has_but & (pos < but_pos), 0.5, np.where(has_but & (pos > but_pos), 1.5, 1))
+
+        sums = _sequential_sums(vals, doc_ids, n_docs)
+        amp = np.array([_punc_amplifier(doc) for doc in docs])
+        sums += np.sign(sums) * amp
+        compound = sums / np.sqrt(sums * sums + 15)
+        return np.round(compound, 4)
@@ -0,0 +1,98 @@
+from sentiment.features import WINDOWS, feature_columns
+import numpy as np
+import json
+
+
+class OnlineFeatures:
+
+    def __init__(self, names, windows=WINDOWS):
+        self.names = list(names)
+        self.windows = list(windows)
+        n = len(self.names)
+        self.decays = np.array([1 - 2 / (win + 1) for win in self.windows])[:, None]
+        self.num = np.zeros((len(self.windows), n))
+        self.den = np.zeros((len(self.windows), n))
+        self.buffer = np.full((max(self.windows), n), np.nan)
+        self.total = np.zeros(n)
+        self.n_days = 0
+        self.last_date = None
+        self.last_values = np.full(n, np.nan)
+        # the state before last_date was applied, so a day that got more
+        # articles after it was ingested can be applied again
+        self.prev = None
+
+    def columns(self):
+        return feature_columns(self.names, windows=self.windows)
+
+    STATE = ['num', 'den', 'buffer', 'total', 'last_values']
+
+    def _snapshot(self):
+        snap = {key: np.array(getattr(self, key)) for key in self.STATE}
+        snap.update({'n_days': self.n_days, 'last_date': self.last_date})
+        return snap
+
+    def _restore(self, snap):
+        for key, val in snap.items():
+            setattr(self, key, np.array(val) if key in self.STATE else val)
+
+    def _step(self, values):
+        valid = ~np.isnan(values)
+        self.num = self.num * self.decays + np.where(valid, values, 0)
+        self.den = self.den * self.decays + valid
+        self.buffer[:-1] = self.buffer[1:]
+        self.buffer[-1] = values
+        self.total += np.where(valid, values, 0)
+        self.n_days += 1
+        self.last_values = values
+
+        per_name = []
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ewms = np.where(self.den > 0, self.num / self.den, np.nan)
+        for i, win in enumerate(self.windows):
+            per_name.append(ewms[i])
+            if self.n_days >= win:
+                # nan if any day in the window is nan, like rolling(win).mean()
+                per_name.append(self.buffer[-win:].mean(axis=0))
+            else:
+                per_name.append(np.full(len(values), np.nan))
+        per_name.append(np.where(valid, self.total, np.nan))
+        return np.stack(per_name, axis=1).ravel()
+
+    def update(self, dates, values):
+        # values is (len(dates), n_names), days before last_date are skipped
+        # and last_date itself replaces what was applied for it before
+        values = np.asarray(values, dtype=np.float64).reshape(len(dates), len(self.names))
+        new_dates = []
+        rows = []
+        for date, day_values in zip(dates, values):
+            if self.last_date is not None and date <= self.last_date:
+                if date != self.last_date or self.prev is None:
+                    continue
+                self._restore(self.prev)
+            self.prev = self._snapshot()
+            rows.append(self._step(day_values))
+            new_dates.append(date)
+            self.last_date = date
+        return new_dates, np.array(rows).reshape(len(rows), len(self.columns()))
+
+    def save(self, fn):
+        meta = {'names': self.names, 'windows': self.windows,
+            'n_days': self.n_days, 'last_date': self.last_date}
+        arrays = {key: getattr(self, key) for key in self.STATE}
+        if self.prev is not None:
+            meta['prev'] = {'n_days': self.prev['n_days'], 'last_date': self.prev['last_date']}
+            arrays.update({'prev_' + key: self.prev[key] for key in self.STATE})
+        np.savez(fn, meta=json.dumps(meta), **arrays)
+
+    @classmethod
+    def load(cls, fn):
+        data = np.load(fn)
+        meta = json.loads(str(data['meta']))
+        state = cls(meta['names'], windows=meta['windows'])
+        state.n_days = meta['n_days']
+        state.last_date = meta['last_date']
+        for key in cls.STATE:
+            setattr(state, key, data[key])
+        if 'prev' in meta:
+            state.prev = dict(meta['prev'], **{key: data['prev_' + key] for key in cls.STATE})
+        return state
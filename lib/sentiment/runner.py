@@ -0,0 +1,80 @@
+import numpy as np
+import hashlib
+import shutil
+import json
+import time
+import os
+
+from dataset.config import MAX_PROCS
+from dataset.util import worker_pool, WORKER
+
+
+def _setup_worker(SentAlgo, name, ds_name):
+    # one prep() (model/lexicon load) per worker, not per chunk
+    algo = SentAlgo(name, [], ds_name=ds_name)
+    algo.prep()
+    return {'algo': algo}
+
+
+def _score_chunk(args):
+    docs, fn = args
+    algo = WORKER['algo']
+    np.save(fn, np.array([algo._score(doc) for doc in docs]))
+    return len(docs)
+
+
+def partial_dir(test, folder='data'):
+    return os.path.join(folder, 'partial', test.exp_id)
+
+
+def clear_partial(test, folder='data'):
+    shutil.rmtree(partial_dir(test, folder=folder), ignore_errors=True)
+
+
+def docs_hash(docs):
+    h = hashlib.sha1()
+    for doc in docs:
+        h.update(doc.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _check_partial(chunk_dir, meta):
+    # chunk files are only reused for the same docs cut the same way
+    meta_fn = os.path.join(chunk_dir, 'meta.json')
+    if os.path.exists(meta_fn):
+        with open(meta_fn) as f:
+            if json.load(f) == meta:
+                return
+    if os.path.isdir(chunk_dir) and len(os.listdir(chunk_dir)) > 0:
+        print('Discarding partial chunks in', chunk_dir, 'made for other docs or chunk size')
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+    os.makedirs(chunk_dir)
+    with open(meta_fn, 'w') as f:
+        json.dump(meta, f)
+
+
+def bake_parallel(test, chunk_size=1000, procs=MAX_PROCS, folder='data'):
+
+    # scores test.docs in chunks across a pool, finished chunks are kept on
+    # disk so an interrupted run picks up where it stopped
+    chunk_dir = partial_dir(test, folder=folder)
+    _check_partial(chunk_dir, {'chunk_size': chunk_size, 'n_docs': len(test.docs), 'docs_hash': docs_hash(test.docs)})
+    chunks = []
+    for i, start in enumerate(range(0, len(test.docs), chunk_size)):
+        fn = os.path.join(chunk_dir, '{:06d}.npy'.format(i))
+        chunks.append((test.docs[start:start + chunk_size], fn))
+    todo = [c for c in chunks if not os.path.exists(c[1])]
+    print(test.exp_id, len(chunks) - len(todo), 'of', len(chunks), 'chunks already done')
+
+    start = time.time()
+    done = 0
+    if len(todo) > 0:
+        with worker_pool(min(procs, len(todo)), _setup_worker, (type(test), test.name, test.ds_name)) as pool:
+            for n_docs in pool.imap_unordered(_score_chunk, todo):
+                done += n_docs
+    elapsed = time.time() - start
+
+    test.doc_sent = np.concatenate([np.load(fn) for _, fn in chunks])
+    rate = done / elapsed if done > 0 else 0
+    return rate
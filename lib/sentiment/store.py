@@ -0,0 +1,97 @@
+import numpy as np
+import glob
+import json
+import os
+
+
+STORE_DIR = os.path.join('data', 'sentiment')
+CLIP = 3
+
+
+def _log_half(data):
+    temp = np.abs(data / 2)
+    temp[temp == 0] = 0.001
+    return -np.sign(data) * (np.log(temp) + np.log(2))
+
+
+def _log(data):
+    with np.errstate(divide='ignore'):
+        return -np.sign(data) * (np.log(np.abs(data)) + np.log(2))
+
+
+TRANSFORMS = {
+    'none': lambda data: data,
+    'log_half': _log_half,
+    'log': _log
+}
+
+
+def standardize(raw, transform='none', clip=CLIP):
+    # transform, z-score over the valid (non nan) scores and clip, returns
+    # the scores, the valid mask and the params needed to redo it
+    raw = np.asarray(raw, dtype=np.float64)
+    valid = ~np.isnan(raw)
+    data = TRANSFORMS[transform](raw)
+    mean = float(data[valid].mean())
+    std = float(data[valid].std())
+    data = np.clip((data - mean) / std, -clip, clip)
+    return data, valid, {'transform': transform, 'mean': mean, 'std': std, 'clip': clip}
+
+
+def rescale(raw, norm):
+    # standardize with params from an earlier standardize call
+    raw = np.asarray(raw, dtype=np.float64)
+    data = TRANSFORMS[norm['transform']](raw)
+    return np.clip((data - norm['mean']) / norm['std'], -norm['clip'], norm['clip']), ~np.isnan(raw)
+
+
+def store_dir(exp_id, folder=STORE_DIR):
+    return os.path.join(folder, exp_id)
+
+
+def list_stores(folder=STORE_DIR):
+    return sorted(os.path.dirname(fn) for fn in glob.glob(os.path.join(folder, 'article-sentiment-*-*-*', 'meta.json')))
+
+
+class SentimentStore:
+
+    # raw.npy, std.npy (float32), valid.npy and meta.json under one folder,
+    # standardized once at bake time and memmapped by everything that reads it
+    def __init__(self, raw, std, valid, meta):
+        self.raw = raw
+        self.std = std
+        self.valid = valid
+        self.meta = meta
+
+    @classmethod
+    def from_scores(cls, raw, transform='none', **meta):
+        data, valid, norm = standardize(raw, transform=transform)
+        meta = dict(meta, n=len(data), n_valid=int(valid.sum()), **norm)
+        return cls(np.asarray(raw, dtype=np.float64), data.astype(np.float32), valid, meta)
+
+    def extend(self, raw):
+        # scores for articles added after the bake, scaled with the bake's
+        # params so the existing ones keep their meaning
+        data, valid = rescale(raw, self.meta)
+        raw = np.concatenate([self.raw, np.asarray(raw, dtype=np.float64)])
+        meta = dict(self.meta, n=len(raw), n_valid=int(self.meta['n_valid'] + valid.sum()))
+        return SentimentStore(raw, np.concatenate([self.std, data.astype(np.float32)]),
+            np.concatenate([self.valid, valid]), meta)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        meta_fn = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_fn):
+            os.remove(meta_fn)
+        for key in ['raw', 'std', 'valid']:
+            np.save(os.path.join(path, key + '.npy'), getattr(self, key))
+        # meta.json goes last, list_stores() only picks up finished folders
+        with open(meta_fn, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrs = [np.load(os.path.join(path, key + '.npy'), mmap_mode='r') for key in ['raw', 'std', 'valid']]
+        return cls(*arrs, meta)